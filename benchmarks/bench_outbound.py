@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发送队列性能对比
+在本地启动一个模拟 Telegram Bot API 的 HTTP 服务，按每个聊天、全局的令牌桶限制发送速度，
+超出时像 Telegram 一样返回 429 和 retry_after。很多玩家在多个群里同时发指令时：
+- direct：每条回复直接调用 send_message，收到 429 就等 retry_after 后重试（与以前相同）
+- outbound：通过 OutboundScheduler 发送
+对比总耗时、实际吞吐量、429 次数和回复延迟；outbound 还统计合并发送的回复数
+（同一群组中排队的回复各自引用玩家的指令消息，合并成一条发送）
+
+使用方法：
+    python -m benchmarks.bench_outbound
+    python -m benchmarks.bench_outbound --chats 20 --messages 15 --chat-rate 1 --global-rate 30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot, ReplyParameters
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from bot.outbound import OutboundScheduler, TokenBucket
+
+TOKEN = "123456:bench"
+
+
+class FakeBotApi:
+    """
+    最小的 Bot API 服务：只实现 getMe 和 sendMessage
+    每个聊天和全局各有一个令牌桶，没有令牌时返回 429，retry_after 为等到下一个令牌的秒数（向上取整）
+    """
+
+    def __init__(self, chat_rate: float, chat_burst: float, global_rate: float, global_burst: float, latency: float):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.latency = latency
+        self.accepted = 0
+        self.rejected = 0
+        self.message_id = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    def _handle(self, method: str, params: Dict[str, str]) -> Tuple[int, dict]:
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}}
+
+        chat_id = int(params["chat_id"])
+        now = time.monotonic()
+        chat_bucket = self.chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        delay = max(chat_bucket.delay(now), self.global_bucket.delay(now))
+        if delay > 0:
+            self.rejected += 1
+            retry_after = max(1, int(delay + 0.999))
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }
+
+        chat_bucket.take(now)
+        self.global_bucket.take(now)
+        self.accepted += 1
+        self.message_id += 1
+        return 200, {"ok": True, "result": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup"},
+            "text": params.get("text", ""),
+        }}
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                path = request_line.decode().split()[1]
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if headers.get("content-type", "").startswith("application/json"):
+                    params = {key: str(value) for key, value in json.loads(body or b"{}").items()}
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+                await asyncio.sleep(self.latency)
+                status, payload = self._handle(path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def workload(chats: int, messages: int) -> List[Tuple[float, int, int, str]]:
+    """(相对发出时间, 聊天, 被回复的消息 id, 文本)：各群的玩家在一秒内集中发出指令"""
+    jobs = []
+    for index in range(chats * messages):
+        chat_id = -1000 - index % chats
+        jobs.append((index / (chats * messages), chat_id, index + 1, f"玩家 {index} 的指令结果"))
+    return jobs
+
+
+async def run_direct(bot: Bot, jobs) -> List[float]:
+    latencies = []
+
+    async def reply(offset: float, chat_id: int, reply_to: int, text: str) -> None:
+        await asyncio.sleep(offset)
+        sent_at = time.perf_counter()
+        while True:
+            try:
+                await bot.send_message(chat_id, text, reply_parameters=ReplyParameters(reply_to))
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+        latencies.append(time.perf_counter() - sent_at)
+
+    await asyncio.gather(*(reply(*job) for job in jobs))
+    return latencies
+
+
+async def run_outbound(bot: Bot, jobs, args) -> Tuple[List[float], Dict[str, int]]:
+    outbox = OutboundScheduler(
+        media_registry=None,
+        global_rate=args.global_rate * args.headroom,
+        global_burst=args.global_burst,
+        chat_rate=args.chat_rate * args.headroom,
+        chat_burst=args.chat_burst,
+        max_retries=10
+    )
+    outbox.start(bot)
+    latencies = []
+
+    async def reply(offset: float, chat_id: int, reply_to: int, text: str) -> None:
+        await asyncio.sleep(offset)
+        sent_at = time.perf_counter()
+        await outbox.send(chat_id, text, reply_to_message_id=reply_to)
+        latencies.append(time.perf_counter() - sent_at)
+
+    await asyncio.gather(*(reply(*job) for job in jobs))
+    await outbox.stop()
+    return latencies, outbox.stats
+
+
+async def bench(args, mode: str) -> Dict[str, float]:
+    api = FakeBotApi(args.chat_rate, args.chat_burst, args.global_rate, args.global_burst, args.latency)
+    port = await api.start()
+    bot = Bot(
+        TOKEN,
+        base_url=f"http://127.0.0.1:{port}/bot",
+        request=HTTPXRequest(connection_pool_size=512, pool_timeout=120.0, read_timeout=120.0)
+    )
+    await bot.initialize()
+
+    jobs = workload(args.chats, args.messages)
+    started = time.perf_counter()
+    stats = {"coalesced": 0}
+    if mode == "direct":
+        latencies = await run_direct(bot, jobs)
+    else:
+        latencies, stats = await run_outbound(bot, jobs, args)
+    elapsed = time.perf_counter() - started
+
+    await bot.shutdown()
+    await api.close()
+    latencies.sort()
+    return {
+        "coalesced": stats["coalesced"],
+        "elapsed": elapsed,
+        "sent_per_sec": api.accepted / elapsed,
+        "rejected_429": api.rejected,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="发送队列性能对比")
+    parser.add_argument("--chats", type=int, default=20, help="群组数量")
+    parser.add_argument("--messages", type=int, default=15, help="每个群组的回复数量")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="每个聊天每秒允许的消息数")
+    parser.add_argument("--chat-burst", type=float, default=3, help="每个聊天允许突发的消息数")
+    parser.add_argument("--global-rate", type=float, default=30.0, help="全局每秒允许的消息数")
+    parser.add_argument("--global-burst", type=float, default=30, help="全局允许突发的消息数")
+    parser.add_argument("--headroom", type=float, default=0.95, help="发送队列使用的速度占限制的比例（抵消网络抖动）")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟的 API 延迟（秒）")
+    args = parser.parse_args()
+
+    print(f"{args.chats} 个群组 x {args.messages} 条回复，限制：每个聊天 {args.chat_rate}/秒，全局 {args.global_rate}/秒")
+    for mode in ("direct", "outbound"):
+        result = asyncio.run(bench(args, mode))
+        print(
+            f"{mode:>8}: 耗时 {result['elapsed']:6.2f} 秒  成功 {result['sent_per_sec']:5.1f} 条/秒  "
+            f"429 {result['rejected_429']:5d} 次  合并 {result['coalesced']:4d} 条  "
+            f"延迟 p50 {result['p50_ms']:7.0f} ms  p95 {result['p95_ms']:7.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite PRAGMA 配置档性能对比
+在临时数据库上用模拟的指令组合（查看状态、打坐、采药、排行榜等）并发压测各个配置档
+
+使用方法：
+    python -m benchmarks.bench_pragmas
+    python -m benchmarks.bench_pragmas --players 2000 --ops 20000 --concurrency 64 --profiles default wal
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DB_PRAGMA_PROFILES
+from database import Database
+
+# 模拟的指令组合：(名称, 权重)
+COMMAND_MIX = [
+    ("status", 40),       # /status /beibao 只读
+    ("meditate", 30),     # /dazuo 更新经验和灵力
+    ("gather", 20),       # /caiyao /mine 更新材料
+    ("leaderboard", 5),   # /paihang
+    ("new_player", 5),    # 新玩家 /xiuxian
+]
+
+
+async def run_command(db: Database, command: str, user_id: int, rng: random.Random) -> None:
+    """执行一条模拟指令"""
+    if command == "status":
+        await db.get_player(user_id)
+    elif command == "meditate":
+        player = await db.get_player(user_id)
+        player.exp += rng.randint(15, 30)
+        player.spiritual_power = max(0, player.spiritual_power - 5)
+        await db.update_player(player)
+    elif command == "gather":
+        player = await db.get_player(user_id)
+        player.add_material(rng.choice(["普通药草", "灵气草", "灵石", "青铜源石"]), rng.randint(1, 5))
+        player.spiritual_power = max(0, player.spiritual_power - 15)
+        await db.update_player(player)
+    elif command == "leaderboard":
+        await db.get_leaderboard(20)
+    elif command == "new_player":
+        await db.get_or_create(user_id, f"user{user_id}", f"User {user_id}")
+
+
+async def bench_profile(profile: str, players: int, ops: int, concurrency: int, seed: int) -> Dict[str, float]:
+    """压测单个配置档，返回吞吐量和延迟统计"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = Database(os.path.join(tmpdir, "bench.db"), pragma_profile=profile)
+        await db.init_database()
+
+        for user_id in range(1, players + 1):
+            await db.get_or_create(user_id, f"user{user_id}", f"User {user_id}")
+
+        rng = random.Random(seed)
+        names = [name for name, _ in COMMAND_MIX]
+        weights = [weight for _, weight in COMMAND_MIX]
+        next_new_player = players + 1
+        jobs = []
+        for _ in range(ops):
+            command = rng.choices(names, weights)[0]
+            if command == "new_player":
+                user_id = next_new_player
+                next_new_player += 1
+            else:
+                user_id = rng.randint(1, players)
+            jobs.append((command, user_id))
+
+        latencies: List[float] = []
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        async def worker(worker_id: int) -> None:
+            worker_rng = random.Random(seed + worker_id)
+            while True:
+                try:
+                    command, user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                await run_command(db, command, user_id, worker_rng)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        await db.close()
+
+    latencies.sort()
+    return {
+        "ops_per_sec": ops / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="对比 SQLite PRAGMA 配置档的性能")
+    parser.add_argument("--players", type=int, default=1000, help="预先创建的玩家数量")
+    parser.add_argument("--ops", type=int, default=5000, help="执行的指令总数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发执行的指令数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument(
+        "--profiles", nargs="+", default=list(DB_PRAGMA_PROFILES),
+        choices=list(DB_PRAGMA_PROFILES), help="要对比的配置档"
+    )
+    args = parser.parse_args()
+
+    print(f"玩家: {args.players}  指令: {args.ops}  并发: {args.concurrency}")
+    print(f"{'配置档':<10}{'ops/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for profile in args.profiles:
+        result = await bench_profile(profile, args.players, args.ops, args.concurrency, args.seed)
+        print(
+            f"{profile:<10}{result['ops_per_sec']:>10.0f}{result['p50_ms']:>10.2f}"
+            f"{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
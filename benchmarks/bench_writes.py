@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+玩家写入合并（group commit）性能对比
+模拟大量玩家同时 /dazuo：每个并发任务反复修改经验和灵力并调用 update_player，
+对比逐条提交（每次写入一个事务）和合并提交的吞吐量
+
+使用方法：
+    python -m benchmarks.bench_writes
+    python -m benchmarks.bench_writes --players 200 --rounds 20 --batch-delay 0.002
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DB_WRITE_BATCH_DELAY, DB_WRITE_BATCH_SIZE
+from database import Database, WriteCoalescer
+
+
+async def bench(players: int, rounds: int, batch_delay: float, batch_size: int, profile: str) -> Dict[str, float]:
+    """并发写入 players * rounds 次，返回吞吐量和延迟统计"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = Database(os.path.join(tmpdir, "bench.db"), pragma_profile=profile)
+        db.writer = WriteCoalescer(db.pool, max_delay=batch_delay, max_batch=batch_size)
+        await db.init_database()
+
+        loaded = []
+        for user_id in range(1, players + 1):
+            loaded.append(await db.get_or_create(user_id, f"user{user_id}", f"User {user_id}"))
+
+        latencies: List[float] = []
+
+        async def meditate(player) -> None:
+            for _ in range(rounds):
+                player.exp += 20
+                player.spiritual_power = max(0, player.spiritual_power - 5)
+                player.add_material("灵石", 1)
+                started = time.perf_counter()
+                await db.update_player(player)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(meditate(player) for player in loaded))
+        elapsed = time.perf_counter() - started
+        transactions = db.writer.batches
+        await db.close()
+
+    latencies.sort()
+    writes = players * rounds
+    return {
+        "writes_per_sec": writes / elapsed,
+        "transactions": transactions,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="对比逐条提交和合并提交的玩家写入吞吐量")
+    parser.add_argument("--players", type=int, default=200, help="同时写入的玩家数量")
+    parser.add_argument("--rounds", type=int, default=10, help="每个玩家的写入次数")
+    parser.add_argument("--batch-delay", type=float, default=DB_WRITE_BATCH_DELAY, help="合并等待时间（秒）")
+    parser.add_argument("--batch-size", type=int, default=DB_WRITE_BATCH_SIZE, help="每个事务最多合并的写入数量")
+    parser.add_argument("--profile", default="wal", help="PRAGMA 配置档")
+    args = parser.parse_args()
+
+    modes = [
+        ("逐条提交", 0.0, 1),
+        ("合并提交", args.batch_delay, args.batch_size),
+    ]
+    print(f"玩家: {args.players}  每人写入: {args.rounds}  配置档: {args.profile}")
+    print(f"{'模式':<10}{'writes/s':>10}{'事务数':>8}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for name, delay, size in modes:
+        result = await bench(args.players, args.rounds, delay, size, args.profile)
+        print(
+            f"{name:<10}{result['writes_per_sec']:>10.0f}{result['transactions']:>8}"
+            f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人战斗日志
+伤害被压到 1 点时一场战斗可能有上千次出手，逐条输出会超过 Telegram 单条消息的长度限制，
+这里只保留每场交战开头和结尾的出手记录，再附上回合数和伤害合计
+"""
+
+import itertools
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from config import BATTLE_LOG_MAX_BYTES, BATTLE_LOG_HEAD_EVENTS, BATTLE_LOG_TAIL_EVENTS
+from bot.combat import BattleEvent, BattleResult, ExchangeResult
+
+TRUNCATED_MARK = "……（战斗日志过长，已截断）"
+
+
+def format_event(event: BattleEvent) -> str:
+    """一次出手的日志"""
+    if event.skill:
+        return f"{event.attacker} 使用 {event.skill}，对{event.defender}造成了 {event.damage} 点伤害！"
+    return f"{event.attacker}对{event.defender}造成了 {event.damage} 点伤害！"
+
+
+@dataclass
+class _ExchangeLog:
+    """一场交战保留下来的日志片段"""
+    header: str
+    head: List[BattleEvent]
+    tail: List[BattleEvent]
+    total: int
+    footer: List[str]
+
+    def lines(self, head: int, tail: int) -> List[str]:
+        kept_head = self.head[:head]
+        kept_tail = self.tail[len(self.tail) - tail:] if tail else []
+        omitted = self.total - len(kept_head) - len(kept_tail)
+
+        lines = [self.header]
+        lines.extend(format_event(event) for event in kept_head)
+        if omitted > 0:
+            lines.append(f"……省略 {omitted} 次出手……")
+        lines.extend(format_event(event) for event in kept_tail)
+        lines.extend(self.footer)
+        return lines
+
+
+class BattleLogRenderer:
+    """
+    有界的战斗日志渲染器
+
+    每场交战的出手记录逐条流过：开头 head_events 条直接保留，其余只进入长度为 tail_events 的
+    环形缓冲区，内存占用与战斗回合数无关；中间省略的部分用一行说明代替。
+    输出不超过 max_bytes 字节（UTF-8），超出时先逐步减少保留的出手记录，仍然超出时在整行处截断。
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = BATTLE_LOG_MAX_BYTES,
+        head_events: int = BATTLE_LOG_HEAD_EVENTS,
+        tail_events: int = BATTLE_LOG_TAIL_EVENTS
+    ):
+        self.max_bytes = max_bytes
+        self.head_events = head_events
+        self.tail_events = tail_events
+
+    def _collect(self, exchange: ExchangeResult) -> _ExchangeLog:
+        events = exchange.events()
+        head = list(itertools.islice(events, self.head_events))
+        tail = deque(events, maxlen=self.tail_events)
+
+        enemy = exchange.enemy
+        header = f"【Boss战】你遇到了 {enemy.name}!" if enemy.skills else f"你遇到了 {enemy.name}!"
+        footer = [
+            f"共 {exchange.rounds} 回合：造成 {exchange.damage_dealt} 点伤害，受到 {exchange.damage_taken} 点伤害"
+        ]
+        if exchange.skill_sequence:
+            skills = "、".join(f"{name}×{count}" for name, count in exchange.skill_counts.items())
+            footer.append(f"{enemy.name} 施展技能：{skills}")
+        if exchange.won:
+            footer.append(f"你击败了 {enemy.name}！剩余生命: {max(0, exchange.hp_after)}")
+        else:
+            footer.append(f"你被 {enemy.name} 击败了……")
+
+        return _ExchangeLog(header, head, list(tail), exchange.event_count, footer)
+
+    def _detail_levels(self) -> List[Tuple[int, int]]:
+        """保留出手记录条数的候选值，从多到少"""
+        levels = []
+        head, tail = self.head_events, self.tail_events
+        while head or tail:
+            levels.append((head, tail))
+            head, tail = head // 2, tail // 2
+        levels.append((0, 0))
+        return levels
+
+    def _truncate(self, text: str) -> str:
+        """按字节截断到最后一个完整的行"""
+        limit = self.max_bytes - len(TRUNCATED_MARK.encode('utf-8')) - 1
+        if limit <= 0:
+            return ""
+        cut = text.encode('utf-8')[:limit].decode('utf-8', errors='ignore')
+        if "\n" in cut:
+            cut = cut[:cut.rindex("\n")]
+        return f"{cut}\n{TRUNCATED_MARK}"
+
+    def render(self, battle: BattleResult) -> str:
+        """渲染整场战斗的日志"""
+        logs = [self._collect(exchange) for exchange in battle.exchanges]
+
+        text = ""
+        for head, tail in self._detail_levels():
+            text = "\n".join(line for log in logs for line in log.lines(head, tail))
+            if len(text.encode('utf-8')) <= self.max_bytes:
+                return text
+        return self._truncate(text)
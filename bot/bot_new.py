@@ -8,7 +8,7 @@
 import os
 import asyncio
 import logging
-from typing import Dict
+from typing import Dict, Optional
 import requests
 import time
 
@@ -27,11 +27,18 @@ sys.path.insert(0, current_dir)
 
 from config import (
     TELEGRAM_BOT_TOKEN, GAME_CHANNELS, ALLOWED_CHANNELS, 
-    ALLOWED_ANN, WITHDRAW_ANN, LOG_LEVEL, LOG_FORMAT
+    ALLOWED_ANN, WITHDRAW_ANN, LOG_LEVEL, LOG_FORMAT, MEDIA_CACHE_CHAT_ID, UPDATE_CONCURRENCY
 )
-from database import init_db, get_player, create_player, update_player
+from database import init_db, close_db, get_player, create_player, update_player
 from xianxia_game import XianXiaGame
 from weapon_enhancement import WeaponEnhancement
+from bot.media import media_registry
+from bot.dispatch import (
+    Command, CommandContext, Dispatcher, identify, Timing, Deliver, map_errors,
+    ChannelGuard, FloodGuard, SerializeUser, require_args
+)
+from bot.locks import user_locks
+from bot.outbound import outbox
 
 # 配置日志
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
@@ -41,387 +48,109 @@ logger = logging.getLogger(__name__)
 xianxia_game = None
 weapon_enhancement = WeaponEnhancement()
 
-# 创建Application实例
-application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-
-async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/start命令"""
-    await update.message.reply_text("欢迎使用修仙机器人！\n\n发送 /xiuxian 开始你的修仙之旅！", parse_mode=ParseMode.HTML)
-
-async def xiuxian_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/xiuxian命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        status = await xianxia_game.get_status(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        if status:
-            response = (
-                f"{status}\n\n"
-                f"修仙指南: \n"
-                f"/dazuo - 打坐修炼\n"
-                f"/caiyao - 采集药材\n"
-                f"/mine - 矿洞采矿\n"
-                f"/elsevier - 爱思唯尔副本\n"
-                f"/wuqi - 铁匠铺\n"
-                f"/zahuo - 杂货铺\n"
-                f"/maiwuqi - 购买武器\n"
-                f"/zhuangbei - 装备武器\n"
-                f"/qianghua - 强化武器\n"
-                f"/check_weapon - 查看武器\n"
-                f"/paihang - 排行榜\n"
-                f"/status - 查看状态\n"
-                f"/beibao - 查看背包\n"
-            )
-            
-            # 尝试发送视频，如果失败则发送文本
-            try:
-                with open('./videos/xiuxian.mp4', 'rb') as video:
-                    await message.reply_video(
-                        video=video,
-                        caption=response,
-                        parse_mode=ParseMode.HTML
-                    )
-            except Exception as video_error:
-                logger.warning(f"发送视频失败，改为发送文本: {video_error}")
-                await message.reply_text(response, parse_mode=ParseMode.HTML)
-        else:
-            await message.reply_text("获取状态失败,请稍后重试。")
-    except Exception as e:
-        logger.error(f"修仙命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def dazuo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/dazuo命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        result = await xianxia_game.meditate(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        if result:
-            # 尝试发送视频，如果失败则发送文本
-            try:
-                with open('./videos/dazuo.mp4', 'rb') as video:
-                    await message.reply_video(
-                        video=video,
-                        caption=result,
-                        parse_mode=ParseMode.HTML
-                    )
-            except Exception as video_error:
-                logger.warning(f"发送视频失败，改为发送文本: {video_error}")
-                await message.reply_text(result, parse_mode=ParseMode.HTML)
-        else:
-            await message.reply_text("打坐失败,请稍后重试。")
-    except Exception as e:
-        logger.error(f"打坐命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/status命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        status = await xianxia_game.get_status(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        if status:
-            await message.reply_text(status, parse_mode=ParseMode.HTML)
-        else:
-            await message.reply_text("获取状态失败,请稍后重试。")
-    except Exception as e:
-        logger.error(f"状态命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def caiyao_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/caiyao命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        result = await xianxia_game.gather_herbs(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"采药命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def mine_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/mine命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        result = await xianxia_game.mine(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"挖矿命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def beibao_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/beibao命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        result = await xianxia_game.get_inventory(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"背包命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def paihang_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/paihang命令"""
-    try:
-        message = update.message
-        
-        result = await xianxia_game.get_leaderboard()
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"排行榜命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def maiwuqi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/maiwuqi命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        # 获取武器名称参数
-        args = context.args
-        if not args:
-            await message.reply_text("请指定要购买的武器名称，例如：/maiwuqi 铁剑")
-            return
-            
-        weapon_name = " ".join(args)
-        result = await xianxia_game.buy_weapon(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            weapon_name=weapon_name
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"购买武器命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def zhuangbei_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/zhuangbei命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        # 获取武器名称参数
-        args = context.args
-        if not args:
-            await message.reply_text("请指定要装备的武器名称，例如：/zhuangbei 铁剑")
-            return
-            
-        weapon_name = " ".join(args)
-        result = await xianxia_game.equip_weapon(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            weapon_name=weapon_name
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"装备武器命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def wuqi_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/wuqi命令 - 查看武器列表"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        result = await xianxia_game.list_weapons(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"武器列表命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def elsevier_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/elsevier命令"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        # 获取副本名称参数
-        args = context.args
-        stage_name = " ".join(args) if args else None
-        
-        result = await xianxia_game.challenge_elsevier(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            stage_name=stage_name,
-            chat_id=message.chat.id,
-            message_thread_id=getattr(message, 'message_thread_id', None)
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"副本挑战命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def zahuo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/zahuo命令 - 杂货铺"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        result = await xianxia_game.visit_shop(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"杂货铺命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def qianghua_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/qianghua命令 - 强化武器"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
-
-        # 获取武器名称参数
-        args = context.args
-        if not args:
-            await message.reply_text("请指定要强化的武器名称，例如：/qianghua 铁剑")
-            return
-            
-        weapon_name = " ".join(args)
-        result = await xianxia_game.enhance_weapon(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name,
-            weapon_name=weapon_name
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"强化武器命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
-
-async def check_weapon_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """处理/check_weapon命令 - 查看武器详情"""
-    try:
-        message = update.message
-        user = message.from_user
-        username = user.username or str(user.id)
-        full_name = user.first_name
-        if user.last_name:
-            full_name += f" {user.last_name}"
+async def on_startup(app: Application) -> None:
+    """在轮询所用的事件循环中初始化数据库，重建冷却索引，预热媒体文件，并启动发送队列"""
+    await init_db()
+    logger.info("数据库初始化完成")
+    await xianxia_game.load_cooldowns()
+    await media_registry.load()
+    await media_registry.warm_up(app.bot, MEDIA_CACHE_CHAT_ID)
+    outbox.start(app.bot)
+
+async def on_stop(app: Application) -> None:
+    """停止处理更新后发送完队列中的消息（此时 bot 的网络连接还没有关闭）"""
+    await outbox.stop()
+
+async def on_shutdown(app: Application) -> None:
+    """停止轮询后关闭数据库连接池"""
+    await close_db()
+
+# 创建Application实例；不同玩家的更新并发处理，同一玩家的指令由 SerializeUser 依次处理
+application = (
+    Application.builder()
+    .token(TELEGRAM_BOT_TOKEN)
+    .concurrent_updates(UPDATE_CONCURRENCY)
+    .post_init(on_startup)
+    .post_stop(on_stop)
+    .post_shutdown(on_shutdown)
+    .build()
+)
 
-        result = await xianxia_game.check_weapon(
-            user_id=user.id,
-            username=username,
-            screen_name=full_name
-        )
-        
-        await message.reply_text(result, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        logger.error(f"查看武器命令处理错误: {e}", exc_info=True)
-        await message.reply_text(f"发生错误: {str(e)}")
+async def start(ctx: CommandContext) -> str:
+    return "欢迎使用修仙机器人！\n\n发送 /xiuxian 开始你的修仙之旅！"
+
+async def xiuxian(ctx: CommandContext) -> Optional[str]:
+    status = await xianxia_game.get_status(**ctx.player, **ctx.location)
+    if not status:
+        return None
+    return (
+        f"{status}\n\n"
+        f"修仙指南: \n"
+        f"/dazuo - 打坐修炼\n"
+        f"/caiyao - 采集药材\n"
+        f"/mine - 矿洞采矿\n"
+        f"/elsevier - 爱思唯尔副本\n"
+        f"/wuqi - 铁匠铺\n"
+        f"/zahuo - 杂货铺\n"
+        f"/maiwuqi - 购买武器\n"
+        f"/zhuangbei - 装备武器\n"
+        f"/qianghua - 强化武器\n"
+        f"/check_weapon - 查看武器\n"
+        f"/paihang - 排行榜\n"
+        f"/paiming - 我的排名\n"
+        f"/status - 查看状态\n"
+        f"/beibao - 查看背包\n"
+    )
+
+# 指令表：指令名、日志中的名称、处理函数；在允许的频道中才能使用的指令由 ChannelGuard 统一检查
+# （/xiuxian 和 /dazuo 在游戏方法中检查频道，频道外也和以前一样随视频回复错误信息和修仙指南）
+COMMANDS = [
+    Command("start", "开始", start),
+    Command("xiuxian", "修仙", xiuxian,
+            media="videos/xiuxian.mp4", fallback="获取状态失败,请稍后重试。"),
+    Command("dazuo", "打坐", lambda ctx: xianxia_game.meditate(**ctx.player, **ctx.location),
+            media="videos/dazuo.mp4", fallback="打坐失败,请稍后重试。"),
+    Command("status", "状态", lambda ctx: xianxia_game.get_status(**ctx.player, **ctx.location),
+            fallback="获取状态失败,请稍后重试。", channel_only=True),
+    Command("caiyao", "采药", lambda ctx: xianxia_game.gather_herbs(**ctx.player, **ctx.location),
+            channel_only=True),
+    Command("mine", "挖矿", lambda ctx: xianxia_game.mine(**ctx.player, **ctx.location),
+            channel_only=True),
+    Command("beibao", "背包", lambda ctx: xianxia_game.get_inventory(**ctx.player, **ctx.location),
+            channel_only=True),
+    Command("paihang", "排行榜", lambda ctx: xianxia_game.get_leaderboard()),
+    Command("paiming", "排名", lambda ctx: xianxia_game.get_rank_info(**ctx.player, **ctx.location),
+            channel_only=True),
+    Command("maiwuqi", "购买武器", lambda ctx: xianxia_game.buy_weapon(**ctx.player, weapon_name=ctx.arg_text),
+            usage="请指定要购买的武器名称，例如：/maiwuqi 铁剑"),
+    Command("zhuangbei", "装备武器", lambda ctx: xianxia_game.equip_weapon(**ctx.player, weapon_name=ctx.arg_text),
+            usage="请指定要装备的武器名称，例如：/zhuangbei 铁剑"),
+    Command("wuqi", "武器列表", lambda ctx: xianxia_game.list_weapons(**ctx.player)),
+    Command("elsevier", "副本挑战", lambda ctx: xianxia_game.challenge_elsevier(
+        **ctx.player, stage_name=ctx.arg_text or None, **ctx.location)),
+    Command("zahuo", "杂货铺", lambda ctx: xianxia_game.visit_shop(**ctx.player)),
+    Command("qianghua", "强化武器", lambda ctx: xianxia_game.enhance_weapon(**ctx.player, weapon_name=ctx.arg_text),
+            usage="请指定要强化的武器名称，例如：/qianghua 铁剑"),
+    Command("check_weapon", "查看武器", lambda ctx: xianxia_game.check_weapon(**ctx.player)),
+]
+
+def channel_error(chat_id: int, message_thread_id: Optional[int]) -> Optional[str]:
+    """不在允许的频道中时返回错误信息"""
+    if xianxia_game.check_channel_permission(chat_id, message_thread_id):
+        return None
+    return xianxia_game.format_error_message(chat_id)
+
+# 指令处理流程，靠前的中间件在外层
+dispatcher = Dispatcher([
+    identify,
+    Timing(),
+    Deliver(outbox),
+    map_errors,
+    ChannelGuard(channel_error),
+    FloodGuard(),
+    SerializeUser(user_locks),
+    require_args,
+])
 
 def main():
     """主函数"""
@@ -429,11 +158,7 @@ def main():
         print("[DEBUG] 程序开始启动...")
         logger.info("启动机器人...")
         
-        # 初始化数据库（同步方式）
-        print("[DEBUG] 初始化数据库...")
-        asyncio.run(init_db())
-        print("[DEBUG] 数据库初始化完成")
-        logger.info("数据库初始化完成")
+        # 数据库在 on_startup 中随事件循环一起初始化，连接池的连接才能在轮询期间复用
         
         # 初始化游戏系统
         print("[DEBUG] 初始化游戏系统...")
@@ -444,21 +169,7 @@ def main():
         
         # 注册命令处理器
         print("[DEBUG] 注册命令处理器...")
-        application.add_handler(CommandHandler("start", start_handler))
-        application.add_handler(CommandHandler("xiuxian", xiuxian_handler))
-        application.add_handler(CommandHandler("dazuo", dazuo_handler))
-        application.add_handler(CommandHandler("status", status_handler))
-        application.add_handler(CommandHandler("caiyao", caiyao_handler))
-        application.add_handler(CommandHandler("mine", mine_handler))
-        application.add_handler(CommandHandler("beibao", beibao_handler))
-        application.add_handler(CommandHandler("paihang", paihang_handler))
-        application.add_handler(CommandHandler("maiwuqi", maiwuqi_handler))
-        application.add_handler(CommandHandler("zhuangbei", zhuangbei_handler))
-        application.add_handler(CommandHandler("wuqi", wuqi_handler))
-        application.add_handler(CommandHandler("elsevier", elsevier_handler))
-        application.add_handler(CommandHandler("zahuo", zahuo_handler))
-        application.add_handler(CommandHandler("qianghua", qianghua_handler))
-        application.add_handler(CommandHandler("check_weapon", check_weapon_handler))
+        dispatcher.register(application, COMMANDS)
         print("[DEBUG] 命令处理器注册完成")
         
         # 启动机器人（需要在事件循环中运行）
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人战斗引擎
+双方伤害固定的回合用公式直接结算，只有 Boss 技能需要逐次抽样；
+结算结果与具体指令无关，副本挑战和以后的玩家切磋都可以复用
+"""
+
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Iterator, NamedTuple, Any
+
+
+@dataclass(frozen=True, slots=True)
+class Skill:
+    """技能：每次使用造成固定伤害（再减去目标防御）"""
+    name: str
+    damage: int
+
+
+@dataclass(frozen=True, slots=True)
+class Combatant:
+    """参战单位：玩家、怪物、Boss，以后也可以是另一名玩家"""
+    name: str
+    hp: int
+    attack: int
+    defense: int
+    skills: Tuple[Skill, ...] = ()
+
+    @classmethod
+    def from_config(cls, data: Dict[str, Any]) -> 'Combatant':
+        """从副本配置中的怪物/Boss 字典创建"""
+        return cls(
+            name=data['name'],
+            hp=data['hp'],
+            attack=data.get('attack', 0),
+            defense=data.get('defense', 0),
+            skills=tuple(Skill(skill['name'], skill['damage']) for skill in data.get('skills', ()))
+        )
+
+    @classmethod
+    def from_player(cls, player: Any, name: str = "你") -> 'Combatant':
+        """从 PlayerData 创建，攻击力包含装备武器"""
+        return cls(
+            name=name,
+            hp=player.max_hp,
+            attack=int(player.total_attack),
+            defense=player.defense
+        )
+
+
+class BattleEvent(NamedTuple):
+    """一次出手"""
+    attacker: str
+    defender: str
+    damage: int
+    skill: Optional[str] = None
+
+
+def hit_damage(attack: int, defense: int) -> int:
+    """单次攻击伤害：攻击减防御，至少为 1"""
+    return max(1, int(attack) - int(defense))
+
+
+@dataclass
+class ExchangeResult:
+    """与一名敌人交战的结果"""
+    enemy: Combatant
+    won: bool
+    hp_before: int
+    hp_after: int
+    rounds: int                # 我方出手次数
+    hit_damage: int            # 我方每次造成的伤害
+    enemy_hits: int            # 敌方出手次数
+    damage_taken: int
+    enemy_hit_damage: Optional[int] = None               # 敌方普通攻击每次的伤害
+    skill_sequence: List[int] = field(default_factory=list)  # 敌方每次出手使用的技能下标
+    skill_damages: List[int] = field(default_factory=list)   # 敌方各技能对我方的伤害
+    name: str = "你"                                          # 我方名称
+
+    @property
+    def damage_dealt(self) -> int:
+        return self.rounds * self.hit_damage
+
+    @property
+    def skill_counts(self) -> Dict[str, int]:
+        """各技能的使用次数"""
+        counts = Counter(self.skill_sequence)
+        return {self.enemy.skills[index].name: counts[index] for index in sorted(counts)}
+
+    @property
+    def event_count(self) -> int:
+        return self.rounds + self.enemy_hits
+
+    def events(self) -> Iterator[BattleEvent]:
+        """按出手顺序逐条生成出手记录，不保存整场战斗的日志"""
+        enemy = self.enemy
+        for turn in range(self.rounds):
+            yield BattleEvent(self.name, enemy.name, self.hit_damage)
+            if turn >= self.enemy_hits:
+                break
+            if self.skill_sequence:
+                index = self.skill_sequence[turn]
+                yield BattleEvent(enemy.name, self.name, self.skill_damages[index], enemy.skills[index].name)
+            else:
+                yield BattleEvent(enemy.name, self.name, self.enemy_hit_damage)
+
+
+@dataclass
+class BattleResult:
+    """依次与多名敌人交战的结果"""
+    won: bool
+    hp_after: int
+    exchanges: List[ExchangeResult] = field(default_factory=list)
+
+
+def resolve_exchange(
+    hp: int,
+    attack: int,
+    defense: int,
+    enemy: Combatant,
+    rng: Any = None,
+    name: str = "你"
+) -> ExchangeResult:
+    """
+    结算一场交战：我方先手，双方轮流出手，直到一方生命值归零
+
+    普通攻击每回合伤害固定，击倒对方所需回合数直接用 ceil(hp / 伤害) 算出；
+    敌方有技能时每次出手用一次 rng.choice 选择技能（与以前逐回合的循环消耗同样的随机数），
+    累计伤害达到我方生命值或敌人被击倒时停止抽样。
+    """
+    rng = rng or random
+    damage = hit_damage(attack, enemy.defense)
+    rounds_to_kill = -(-enemy.hp // damage)
+    # 我方在第 rounds_to_kill 次出手时击倒敌人，敌人最多出手 rounds_to_kill - 1 次
+    max_enemy_hits = max(0, rounds_to_kill - 1)
+
+    if hp <= 0:
+        return ExchangeResult(enemy, False, hp, hp, 0, damage, 0, 0, name=name)
+
+    if not enemy.skills:
+        enemy_damage = hit_damage(enemy.attack, defense)
+        hits_to_die = -(-hp // enemy_damage)
+        if hits_to_die <= max_enemy_hits:
+            # 敌人的第 hits_to_die 次出手击倒我方，此时我方出手了同样的次数
+            won, rounds, enemy_hits = False, hits_to_die, hits_to_die
+        else:
+            won, rounds, enemy_hits = True, rounds_to_kill, max_enemy_hits
+        damage_taken = enemy_hits * enemy_damage
+        return ExchangeResult(
+            enemy, won, hp, hp - damage_taken, rounds, damage,
+            enemy_hits, damage_taken, enemy_hit_damage=enemy_damage, name=name
+        )
+
+    skill_damages = [hit_damage(skill.damage, defense) for skill in enemy.skills]
+    indices = range(len(skill_damages))
+    sequence: List[int] = []
+    damage_taken = 0
+    while len(sequence) < max_enemy_hits and damage_taken < hp:
+        index = rng.choice(indices)
+        sequence.append(index)
+        damage_taken += skill_damages[index]
+
+    enemy_hits = len(sequence)
+    if damage_taken >= hp:
+        won, rounds = False, enemy_hits
+    else:
+        won, rounds = True, rounds_to_kill
+
+    return ExchangeResult(
+        enemy, won, hp, hp - damage_taken, rounds, damage,
+        enemy_hits, damage_taken, skill_sequence=sequence, skill_damages=skill_damages, name=name
+    )
+
+
+def resolve_battle(player: Combatant, enemies: List[Combatant], rng: Any = None) -> BattleResult:
+    """
+    依次与每名敌人交战，生命值在交战之间不恢复
+    """
+    hp = player.hp
+    exchanges = []
+    for enemy in enemies:
+        result = resolve_exchange(hp, player.attack, player.defense, enemy, rng, player.name)
+        exchanges.append(result)
+        hp = result.hp_after
+        if not result.won:
+            return BattleResult(False, hp, exchanges)
+    return BattleResult(True, hp, exchanges)
+
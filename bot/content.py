@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人游戏内容
+药园、矿洞、秘境、武器和强化等数值配置保存在 data/content.json 中，
+启动时校验并编译成不可变的记录，整个进程共享同一份；修改数值后调用 reload_content 即可热更新
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple, Any
+
+from config import GAME_CONTENT_PATH
+from models.realm_data import REALM_LEVELS, index_by_realm
+from bot.combat import Combatant
+from bot.rewards import LootTable, compile_loot
+
+logger = logging.getLogger(__name__)
+
+# 支持的内容文件版本
+CONTENT_VERSION = 1
+
+# 采矿时每种物品的获得概率
+MINING_DROP_CHANCE = 0.7
+
+
+class ContentError(ValueError):
+    """游戏内容文件格式错误"""
+
+
+@dataclass(frozen=True, slots=True)
+class ItemRange:
+    """数量在 [low, high] 之间均匀随机的物品"""
+    name: str
+    low: int
+    high: int
+
+
+@dataclass(frozen=True, slots=True)
+class RareDrop:
+    """按概率掉落一个的稀有物品"""
+    name: str
+    chance: float
+
+
+@dataclass(frozen=True, slots=True)
+class HerbLocation:
+    name: str
+    herbs: Tuple[str, ...]
+    min_realm: str
+    spiritual_power_cost: int
+
+
+@dataclass(frozen=True, slots=True)
+class MiningLocation:
+    name: str
+    min_realm: str
+    spirit_cost: int
+    rewards: Tuple[ItemRange, ...]
+    exp: Tuple[int, int]
+    loot: LootTable
+
+
+@dataclass(frozen=True, slots=True)
+class StageRewards:
+    exp: Tuple[int, int]
+    items: Tuple[ItemRange, ...]
+    rare_items: Tuple[RareDrop, ...]
+    loot: LootTable
+
+
+@dataclass(frozen=True, slots=True)
+class Stage:
+    """秘境副本：依次挑战 enemies，Boss 关只有一个带技能的敌人"""
+    name: str
+    min_realm: str
+    spirit_cost: int
+    enemies: Tuple[Combatant, ...]
+    rewards: StageRewards
+    is_boss: bool
+
+
+@dataclass(frozen=True, slots=True)
+class WeaponSpec:
+    """武器商店中的武器模板"""
+    name: str
+    type: str
+    attack: int
+    rarity: str
+    description: str
+    price: int
+    required_realm: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为新武器的数据字典（每次返回新的字典，可以放心修改）"""
+        return {
+            'name': self.name,
+            'type': self.type,
+            'attack': self.attack,
+            'rarity': self.rarity,
+            'description': self.description,
+            'price': self.price,
+            'required_realm': self.required_realm,
+            'enhancement_level': 0,
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class EnhancementLevel:
+    """从当前等级强化到下一级：成功率（%）、费用（灵石）、成功后增加的攻击力"""
+    rate: int
+    cost: int
+    attack_bonus: int
+
+
+@dataclass(frozen=True, slots=True)
+class GameContent:
+    """编译后的全部游戏内容，*_by_level[境界序号] 是该境界可用的名称"""
+    version: int
+    herb_locations: Mapping[str, HerbLocation]
+    herb_values: Mapping[str, int]
+    mining_locations: Mapping[str, MiningLocation]
+    dungeon_name: str
+    dungeon_description: str
+    stages: Mapping[str, Stage]
+    special_items: Mapping[str, Any]
+    crafting: Mapping[str, Any]
+    weapons: Mapping[str, WeaponSpec]
+    enhancement: Tuple[EnhancementLevel, ...]
+    herb_locations_by_level: Tuple[Tuple[str, ...], ...]
+    mining_locations_by_level: Tuple[Tuple[str, ...], ...]
+    stages_by_level: Tuple[Tuple[str, ...], ...]
+    weapons_by_level: Tuple[Tuple[str, ...], ...]
+
+    @property
+    def max_enhancement_level(self) -> int:
+        return len(self.enhancement)
+
+
+def _field(data: Mapping[str, Any], key: str, kind: Any, where: str) -> Any:
+    """读取必填字段并检查类型"""
+    if not isinstance(data, Mapping):
+        raise ContentError(f"{where}: 应为对象")
+    if key not in data:
+        raise ContentError(f"{where}: 缺少字段 {key}")
+    value = data[key]
+    if not isinstance(value, kind) or (isinstance(value, bool) and kind is not bool):
+        raise ContentError(f"{where}.{key}: 类型错误 ({type(value).__name__})")
+    return value
+
+
+def _non_negative(data: Mapping[str, Any], key: str, where: str) -> int:
+    value = _field(data, key, int, where)
+    if value < 0:
+        raise ContentError(f"{where}.{key}: 不能为负数")
+    return value
+
+
+def _range(value: Any, where: str) -> Tuple[int, int]:
+    """[low, high] 形式的数量范围"""
+    if (
+        not isinstance(value, list) or len(value) != 2
+        or not all(isinstance(bound, int) and not isinstance(bound, bool) for bound in value)
+        or not 0 <= value[0] <= value[1]
+    ):
+        raise ContentError(f"{where}: 应为 [最小值, 最大值] 且 0 <= 最小值 <= 最大值")
+    return value[0], value[1]
+
+
+def _realm(data: Mapping[str, Any], key: str, where: str) -> str:
+    realm = _field(data, key, str, where)
+    if realm not in REALM_LEVELS:
+        raise ContentError(f"{where}.{key}: 未知境界 {realm}")
+    return realm
+
+
+def _freeze(value: Any) -> Any:
+    """把嵌套的字典和列表转换为只读的 MappingProxyType 和 tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _by_level(records: Mapping[str, Any], key: str) -> Tuple[Tuple[str, ...], ...]:
+    levels = index_by_realm({name: getattr(record, key) for name, record in records.items()})
+    return tuple(tuple(names) for names in levels)
+
+
+def _compile_herb_locations(data: Mapping[str, Any]) -> Dict[str, HerbLocation]:
+    # 没有在 herb_values 中定价的药材不能出售（价值按 0 计算），这里不要求定价
+    locations = {}
+    for name, info in _field(data, "herb_locations", dict, "content").items():
+        where = f"herb_locations.{name}"
+        herbs = _field(info, "herbs", list, where)
+        if not herbs:
+            raise ContentError(f"{where}.herbs: 不能为空")
+        locations[name] = HerbLocation(
+            name=name,
+            herbs=tuple(herbs),
+            min_realm=_realm(info, "min_realm", where),
+            spiritual_power_cost=_non_negative(info, "spiritual_power_cost", where),
+        )
+    return locations
+
+
+def _compile_mining_locations(data: Mapping[str, Any]) -> Dict[str, MiningLocation]:
+    locations = {}
+    for name, info in _field(data, "mining_locations", dict, "content").items():
+        where = f"mining_locations.{name}"
+        rewards = tuple(
+            ItemRange(item, *_range(bounds, f"{where}.rewards.{item}"))
+            for item, bounds in _field(info, "rewards", dict, where).items()
+        )
+        exp = _range(_field(info, "exp", list, where), f"{where}.exp")
+        locations[name] = MiningLocation(
+            name=name,
+            min_realm=_realm(info, "min_realm", where),
+            spirit_cost=_non_negative(info, "spirit_cost", where),
+            rewards=rewards,
+            exp=exp,
+            loot=compile_loot(exp, [(item.name, item.low, item.high) for item in rewards], MINING_DROP_CHANCE),
+        )
+    return locations
+
+
+def _compile_enemy(data: Mapping[str, Any], where: str) -> Combatant:
+    _field(data, "name", str, where)
+    if _field(data, "hp", int, where) <= 0:
+        raise ContentError(f"{where}.hp: 必须大于 0")
+    for key in ("attack", "defense"):
+        if key in data:
+            _non_negative(data, key, where)
+    for index, skill in enumerate(data.get("skills", ())):
+        _field(skill, "name", str, f"{where}.skills[{index}]")
+        _non_negative(skill, "damage", f"{where}.skills[{index}]")
+    return Combatant.from_config(data)
+
+
+def _compile_stage_rewards(data: Mapping[str, Any], where: str) -> StageRewards:
+    items = []
+    rare_items = []
+    for item, value in _field(data, "items", dict, where).items():
+        if item == "稀有道具":
+            for rare_item, chance in _field(data["items"], item, dict, f"{where}.items").items():
+                if not isinstance(chance, (int, float)) or not 0 <= chance <= 1:
+                    raise ContentError(f"{where}.items.稀有道具.{rare_item}: 概率应在 0 到 1 之间")
+                rare_items.append(RareDrop(rare_item, float(chance)))
+        else:
+            items.append(ItemRange(item, *_range(value, f"{where}.items.{item}")))
+    exp = _range(_field(data, "exp", list, where), f"{where}.exp")
+    return StageRewards(
+        exp=exp,
+        items=tuple(items),
+        rare_items=tuple(rare_items),
+        loot=compile_loot(
+            exp,
+            [(item.name, item.low, item.high) for item in items],
+            rare_items=[(item.name, item.chance) for item in rare_items],
+        ),
+    )
+
+
+def _compile_stages(dungeon: Mapping[str, Any]) -> Dict[str, Stage]:
+    stages = {}
+    for name, info in _field(dungeon, "stages", dict, "elsevier_dungeon").items():
+        where = f"elsevier_dungeon.stages.{name}"
+        if ("boss" in info) == ("monsters" in info):
+            raise ContentError(f"{where}: monsters 和 boss 必须且只能有一个")
+        if "boss" in info:
+            enemies = (_compile_enemy(info["boss"], f"{where}.boss"),)
+            if not enemies[0].skills:
+                raise ContentError(f"{where}.boss: Boss 至少需要一个技能")
+        else:
+            monsters = _field(info, "monsters", list, where)
+            if not monsters:
+                raise ContentError(f"{where}.monsters: 不能为空")
+            enemies = tuple(
+                _compile_enemy(monster, f"{where}.monsters[{index}]") for index, monster in enumerate(monsters)
+            )
+        stages[name] = Stage(
+            name=name,
+            min_realm=_realm(info, "min_realm", where),
+            spirit_cost=_non_negative(info, "spirit_cost", where),
+            enemies=enemies,
+            rewards=_compile_stage_rewards(_field(info, "rewards", dict, where), f"{where}.rewards"),
+            is_boss="boss" in info,
+        )
+    return stages
+
+
+def _compile_weapons(data: Mapping[str, Any]) -> Dict[str, WeaponSpec]:
+    weapons = {}
+    for name, info in _field(data, "weapons", dict, "content").items():
+        where = f"weapons.{name}"
+        weapons[name] = WeaponSpec(
+            name=name,
+            type=_field(info, "type", str, where),
+            attack=_non_negative(info, "attack", where),
+            rarity=_field(info, "rarity", str, where),
+            description=_field(info, "description", str, where),
+            price=_non_negative(info, "price", where),
+            required_realm=_realm(info, "required_realm", where),
+        )
+    return weapons
+
+
+def _compile_enhancement(data: Mapping[str, Any]) -> Tuple[EnhancementLevel, ...]:
+    levels = _field(_field(data, "enhancement", dict, "content"), "levels", list, "enhancement")
+    table = []
+    for level, info in enumerate(levels):
+        where = f"enhancement.levels[{level}]"
+        rate = _non_negative(info, "rate", where)
+        if rate > 100:
+            raise ContentError(f"{where}.rate: 成功率不能超过 100")
+        table.append(EnhancementLevel(rate, _non_negative(info, "cost", where), _non_negative(info, "attack_bonus", where)))
+    return tuple(table)
+
+
+def compile_content(data: Mapping[str, Any]) -> GameContent:
+    """
+    校验并编译内容文件的数据，格式错误时抛出 ContentError
+    """
+    version = _field(data, "version", int, "content")
+    if version != CONTENT_VERSION:
+        raise ContentError(f"不支持的内容文件版本 {version}，当前支持 {CONTENT_VERSION}")
+
+    raw_values = _field(data, "herb_values", dict, "content")
+    herb_values = {item: _non_negative(raw_values, item, "herb_values") for item in raw_values}
+
+    herb_locations = _compile_herb_locations(data)
+    mining_locations = _compile_mining_locations(data)
+    dungeon = _field(data, "elsevier_dungeon", dict, "content")
+    stages = _compile_stages(dungeon)
+    weapons = _compile_weapons(data)
+
+    return GameContent(
+        version=version,
+        herb_locations=MappingProxyType(herb_locations),
+        herb_values=MappingProxyType(herb_values),
+        mining_locations=MappingProxyType(mining_locations),
+        dungeon_name=_field(dungeon, "name", str, "elsevier_dungeon"),
+        dungeon_description=_field(dungeon, "description", str, "elsevier_dungeon"),
+        stages=MappingProxyType(stages),
+        special_items=_freeze(dungeon.get("special_items", {})),
+        crafting=_freeze(dungeon.get("crafting", {})),
+        weapons=MappingProxyType(weapons),
+        enhancement=_compile_enhancement(data),
+        herb_locations_by_level=_by_level(herb_locations, "min_realm"),
+        mining_locations_by_level=_by_level(mining_locations, "min_realm"),
+        stages_by_level=_by_level(stages, "min_realm"),
+        weapons_by_level=_by_level(weapons, "required_realm"),
+    )
+
+
+def load_content(path: str = GAME_CONTENT_PATH) -> GameContent:
+    """读取并编译内容文件"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ContentError(f"无法读取游戏内容文件 {path}: {e}") from e
+    return compile_content(data)
+
+
+_content: Optional[GameContent] = None
+
+
+def get_content() -> GameContent:
+    """进程内共享的游戏内容，第一次调用时加载"""
+    global _content
+    if _content is None:
+        _content = load_content()
+        logger.info(f"游戏内容已加载: 版本 {_content.version}")
+    return _content
+
+
+def reload_content(path: Optional[str] = None) -> GameContent:
+    """
+    重新加载内容文件：新内容校验通过后整体替换，校验失败时抛出 ContentError 并继续使用旧内容
+    """
+    global _content
+    _content = load_content(path or GAME_CONTENT_PATH)
+    logger.info(f"游戏内容已重新加载: 版本 {_content.version}")
+    return _content
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人冷却索引
+打坐、采药、挖矿、挑战的冷却结束时间保存在内存中，冷却中的指令不需要加载玩家数据就能拒绝；
+启动时从数据库中的动作时间重建，过期的条目定期清理
+"""
+
+import logging
+from typing import Dict, Optional, Iterable, Any
+
+from config import COOLDOWN_TIMES
+from models.player_data import now_ms
+
+logger = logging.getLogger(__name__)
+
+# 冷却动作对应的玩家时间字段
+ACTION_FIELDS = {
+    "meditation": "last_meditation_time_ms",
+    "herb_gathering": "last_herb_gathering_time_ms",
+    "mining": "last_mining_time_ms",
+    "challenge": "last_challenge_time_ms",
+}
+
+
+class CooldownManager:
+    """
+    内存中的冷却索引：(user_id, 动作) -> 冷却结束时间（毫秒时间戳）
+
+    指令处理先查这里，冷却中的请求直接拒绝，不需要加载玩家数据。
+    冷却时长来自 config.COOLDOWN_TIMES，启动时根据数据库中的动作时间重建，
+    只保存仍在冷却中的条目，过期的条目在查询时顺带清理，
+    并且每记录 SWEEP_EVERY 次动作清理一次所有过期条目，不再行动的玩家不会一直占用内存。
+    """
+
+    # 每记录这么多次动作清理一次已经过期的条目，限制内存占用
+    SWEEP_EVERY = 1000
+
+    def __init__(self, cooldown_times: Optional[Dict[str, int]] = None):
+        self.cooldown_ms = {
+            action: seconds * 1000
+            for action, seconds in (cooldown_times or COOLDOWN_TIMES).items()
+        }
+        self._ready_at: Dict[str, Dict[int, int]] = {action: {} for action in self.cooldown_ms}
+        self._records = 0
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._ready_at.values())
+
+    @property
+    def max_cooldown_ms(self) -> int:
+        """最长的冷却时间，用于确定启动时需要加载的时间范围"""
+        return max(self.cooldown_ms.values(), default=0)
+
+    def remaining(self, user_id: int, action: str, at_ms: Optional[int] = None) -> int:
+        """
+        剩余冷却秒数（向上取整），0 表示可以执行
+        """
+        entries = self._ready_at[action]
+        ready_at = entries.get(user_id)
+        if ready_at is None:
+            return 0
+
+        remaining_ms = ready_at - (now_ms() if at_ms is None else at_ms)
+        if remaining_ms <= 0:
+            del entries[user_id]
+            return 0
+        return -(-remaining_ms // 1000)
+
+    def record(self, user_id: int, action: str, at_ms: Optional[int]) -> None:
+        """记录一次动作，at_ms 为动作发生的时间"""
+        if at_ms is None:
+            return
+        ready_at = at_ms + self.cooldown_ms[action]
+        entries = self._ready_at[action]
+        if ready_at > entries.get(user_id, 0):
+            entries[user_id] = ready_at
+
+        self._records += 1
+        if self._records % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def sweep(self, at_ms: Optional[int] = None) -> int:
+        """删除所有冷却已经结束的条目，返回删除的数量"""
+        at_ms = now_ms() if at_ms is None else at_ms
+        removed = 0
+        for entries in self._ready_at.values():
+            expired = [user_id for user_id, ready_at in entries.items() if ready_at <= at_ms]
+            for user_id in expired:
+                del entries[user_id]
+            removed += len(expired)
+        return removed
+
+    def start(self, player: Any, action: str, at_ms: Optional[int] = None) -> int:
+        """
+        开始冷却：写入玩家的动作时间并更新索引，返回动作时间
+        """
+        at_ms = now_ms() if at_ms is None else at_ms
+        setattr(player, ACTION_FIELDS[action], at_ms)
+        self.record(player.user_id, action, at_ms)
+        return at_ms
+
+    def load(self, rows: Iterable[Dict[str, Any]], at_ms: Optional[int] = None) -> None:
+        """
+        用数据库中的动作时间重建索引，只保留仍在冷却中的条目
+        """
+        at_ms = now_ms() if at_ms is None else at_ms
+        for entries in self._ready_at.values():
+            entries.clear()
+
+        for row in rows:
+            for action, field_name in ACTION_FIELDS.items():
+                if action not in self.cooldown_ms:
+                    continue
+                last = row.get(field_name)
+                if last is None:
+                    continue
+                # 直接写入索引，重建时不需要触发清理
+                ready_at = last + self.cooldown_ms[action]
+                entries = self._ready_at[action]
+                if ready_at > at_ms and ready_at > entries.get(row['user_id'], 0):
+                    entries[row['user_id']] = ready_at
+
+        logger.info(f"冷却索引已重建: {len(self)} 条冷却中")
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人指令分发
+每条指令经过同一条中间件链：识别玩家 -> 计时 -> 发送回复 -> 错误处理 -> 频道权限 -> 防刷屏 -> 玩家锁 -> 参数检查，
+最后调用指令本身；指令在表中声明，缓存、限流、统计等通用功能只需要在这里加一个中间件
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Sequence
+
+from telegram import Message, Update
+from telegram.constants import ParseMode
+from telegram.ext import Application, CommandHandler, ContextTypes, filters
+
+from config import COMMAND_FLOOD_LIMIT, COMMAND_FLOOD_WINDOW, COMMAND_SLOW_SECONDS
+from bot.locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Command:
+    """
+    一条指令的声明
+
+    action 返回回复文本（HTML）；返回空值时回复 fallback。
+    usage 不为空时指令需要参数，没有参数时回复 usage；media 为随回复发送的图片/视频。
+    channel_only 的指令只能在允许的游戏频道中使用。
+    """
+    name: str
+    title: str
+    action: Callable[['CommandContext'], Awaitable[Optional[str]]]
+    usage: Optional[str] = None
+    media: Optional[str] = None
+    fallback: Optional[str] = None
+    channel_only: bool = False
+
+
+@dataclass
+class CommandContext:
+    """一次指令处理的上下文，中间件之间通过它传递玩家信息和回复"""
+    command: Command
+    update: Update
+    context: ContextTypes.DEFAULT_TYPE
+    message: Optional[Message] = None
+    user_id: int = 0
+    username: str = ""
+    screen_name: str = ""
+    chat_id: int = 0
+    message_thread_id: Optional[int] = None
+    args: List[str] = field(default_factory=list)
+    reply: Optional[str] = None
+    parse_mode: Optional[str] = None
+    media: Optional[str] = None
+
+    @property
+    def player(self) -> Dict[str, Any]:
+        """游戏方法的玩家参数"""
+        return {"user_id": self.user_id, "username": self.username, "screen_name": self.screen_name}
+
+    @property
+    def location(self) -> Dict[str, Any]:
+        """游戏方法的频道参数"""
+        return {"chat_id": self.chat_id, "message_thread_id": self.message_thread_id}
+
+    @property
+    def arg_text(self) -> str:
+        return " ".join(self.args)
+
+    def respond(self, text: str, parse_mode: Optional[str] = None, media: Optional[str] = None) -> None:
+        self.reply, self.parse_mode, self.media = text, parse_mode, media
+
+
+Next = Callable[[], Awaitable[None]]
+Middleware = Callable[[CommandContext, Next], Awaitable[None]]
+
+
+async def identify(ctx: CommandContext, call_next: Next) -> None:
+    """识别发送指令的玩家，没有新消息或发送者（如编辑过的消息、频道消息）时不处理"""
+    # 编辑消息不重新执行指令，否则编辑一次就会再采一次药、再买一次武器
+    message = ctx.update.message
+    user = ctx.update.effective_user
+    if message is None or user is None:
+        return
+
+    full_name = user.first_name
+    if user.last_name:
+        full_name += f" {user.last_name}"
+
+    ctx.message = message
+    ctx.user_id = user.id
+    ctx.username = user.username or str(user.id)
+    ctx.screen_name = full_name
+    ctx.chat_id = message.chat.id
+    ctx.message_thread_id = getattr(message, 'message_thread_id', None)
+    ctx.args = list(ctx.context.args or [])
+    await call_next()
+
+
+class Timing:
+    """统计每条指令的次数和耗时（到回复放入发送队列为止），超过 slow_seconds 时记录警告"""
+
+    def __init__(self, slow_seconds: float = COMMAND_SLOW_SECONDS):
+        self.slow_seconds = slow_seconds
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    async def __call__(self, ctx: CommandContext, call_next: Next) -> None:
+        started = time.perf_counter()
+        try:
+            await call_next()
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.stats.setdefault(ctx.command.name, {"count": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            if elapsed > self.slow_seconds:
+                logger.warning(f"/{ctx.command.name} 处理耗时 {elapsed:.2f} 秒 (user_id: {ctx.user_id})")
+
+
+class Deliver:
+    """
+    把中间件链产生的回复放入发送队列后立即返回，不等待 Telegram 的限速，更新处理的名额马上释放；
+    队列已满时丢弃回复并记录警告。带媒体的回复发送失败时改为只发送文本
+    """
+
+    def __init__(self, outbox: Any):
+        self.outbox = outbox
+
+    async def __call__(self, ctx: CommandContext, call_next: Next) -> None:
+        await call_next()
+        if ctx.reply:
+            self._submit(ctx, ctx.media)
+
+    def _submit(self, ctx: CommandContext, media: Optional[str]) -> None:
+        try:
+            future = self.outbox.submit_reply(ctx.message, ctx.reply, parse_mode=ctx.parse_mode, media=media)
+        except Exception as e:
+            logger.warning(f"/{ctx.command.name} 的回复没有发送 (chat_id: {ctx.chat_id}): {e}")
+            return
+        future.add_done_callback(lambda done: self._sent(ctx, media, done))
+
+    def _sent(self, ctx: CommandContext, media: Optional[str], future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        if media:
+            logger.warning(f"发送媒体失败，改为发送文本: {error}")
+            self._submit(ctx, None)
+        else:
+            logger.error(f"/{ctx.command.name} 回复发送失败: {error}")
+
+
+async def map_errors(ctx: CommandContext, call_next: Next) -> None:
+    """指令出错时记录日志，并回复错误信息"""
+    try:
+        await call_next()
+    except Exception as e:
+        logger.error(f"{ctx.command.title}命令处理错误: {e}", exc_info=True)
+        ctx.respond(f"发生错误: {str(e)}")
+
+
+class ChannelGuard:
+    """channel_only 的指令在不允许的频道中直接回复错误信息，不调用游戏逻辑"""
+
+    def __init__(self, check: Callable[[int, Optional[int]], Optional[str]]):
+        # check(chat_id, message_thread_id) 允许时返回 None，否则返回错误信息
+        self.check = check
+
+    async def __call__(self, ctx: CommandContext, call_next: Next) -> None:
+        if ctx.command.channel_only:
+            error = self.check(ctx.chat_id, ctx.message_thread_id)
+            if error:
+                ctx.respond(error)
+                return
+        await call_next()
+
+
+class FloodGuard:
+    """
+    防刷屏：每名玩家在 window 秒内最多处理 limit 条指令，超出的指令直接忽略（不回复，避免放大消息量）
+    """
+
+    # 每处理这么多条指令清理一次已经过期的玩家记录，限制内存占用
+    SWEEP_EVERY = 1000
+
+    def __init__(self, limit: int = COMMAND_FLOOD_LIMIT, window: float = COMMAND_FLOOD_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._recent: Dict[int, Deque[float]] = {}
+        self._calls = 0
+
+    def allow(self, user_id: int, now: float) -> bool:
+        recent = self._recent.get(user_id)
+        if recent is None:
+            recent = self._recent[user_id] = deque(maxlen=self.limit)
+        if len(recent) == self.limit and now - recent[0] < self.window:
+            return False
+        recent.append(now)
+        return True
+
+    def _sweep(self, now: float) -> None:
+        expired = [user_id for user_id, recent in self._recent.items() if now - recent[-1] >= self.window]
+        for user_id in expired:
+            del self._recent[user_id]
+
+    async def __call__(self, ctx: CommandContext, call_next: Next) -> None:
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % self.SWEEP_EVERY == 0:
+            self._sweep(now)
+        if not self.allow(ctx.user_id, now):
+            logger.debug(f"忽略刷屏指令 /{ctx.command.name} (user_id: {ctx.user_id})")
+            return
+        await call_next()
+
+
+class SerializeUser:
+    """
+    同一玩家的指令依次处理，不同玩家并行处理（配合 Application 的 concurrent_updates）
+    回复在锁外发送，慢速上传不会挡住该玩家的下一条指令
+    """
+
+    def __init__(self, locks: KeyedLocks):
+        self.locks = locks
+
+    async def __call__(self, ctx: CommandContext, call_next: Next) -> None:
+        async with self.locks.hold(ctx.user_id):
+            await call_next()
+
+
+async def require_args(ctx: CommandContext, call_next: Next) -> None:
+    """需要参数的指令没有参数时回复用法"""
+    if ctx.command.usage and not ctx.args:
+        ctx.respond(ctx.command.usage)
+        return
+    await call_next()
+
+
+async def invoke(ctx: CommandContext) -> None:
+    """调用指令本身，结果作为 HTML 回复"""
+    result = await ctx.command.action(ctx)
+    if result:
+        ctx.respond(result, ParseMode.HTML, ctx.command.media)
+    elif ctx.command.fallback:
+        ctx.respond(ctx.command.fallback)
+
+
+class Dispatcher:
+    """按顺序经过中间件链处理指令，middlewares 中靠前的在外层"""
+
+    def __init__(self, middlewares: Sequence[Middleware]):
+        self.middlewares = list(middlewares)
+
+    async def dispatch(self, command: Command, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        ctx = CommandContext(command, update, context)
+
+        async def run(index: int) -> None:
+            if index == len(self.middlewares):
+                await invoke(ctx)
+            else:
+                await self.middlewares[index](ctx, lambda: run(index + 1))
+
+        await run(0)
+
+    def handler(self, command: Command) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]:
+        async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            await self.dispatch(command, update, context)
+        callback.__doc__ = f"处理/{command.name}命令"
+        return callback
+
+    def register(self, application: Application, commands: Iterable[Command]) -> None:
+        """把指令表注册到 Application，只处理新消息中的指令（不处理编辑后的消息）"""
+        for command in commands:
+            application.add_handler(
+                CommandHandler(command.name, self.handler(command), filters=filters.UpdateType.MESSAGE)
+            )
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人按键加锁
+同一个键（如 user_id）的操作依次执行，不同键之间完全并行；
+锁只在有人持有或等待时存在，锁表大小不超过同时在处理的键的数量
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0      # 持有和等待这把锁的协程数量
+
+
+class KeyedLocks:
+    """
+    按键分配的异步锁
+
+        async with user_locks.hold(user_id):
+            ...  # 读取、修改、保存玩家数据
+
+    最后一个使用者释放时删除该键的锁，空闲玩家不占用内存。不可重入：持有锁时再次获取同一个键会死锁。
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, _Entry] = {}
+
+    def active_keys(self) -> List[Hashable]:
+        """当前持有或等待锁的键"""
+        return list(self._entries)
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            # 等待时被取消也要减少计数，否则锁永远不会被删除
+            entry.users -= 1
+            if entry.users == 0:
+                del self._entries[key]
+
+
+# 全局玩家锁：同一玩家的指令依次处理，避免并发读取-修改-保存同一份玩家数据
+user_locks = KeyedLocks()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人媒体文件
+指令附带的图片和视频只在第一次发送时上传，之后用 Telegram 返回的 file_id 发送；
+file_id 和上传时的文件内容哈希保存在 SQLite 中，文件内容变化或 file_id 失效时自动重新上传
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from config import MEDIA_ROOT, MEDIA_DIRS, MEDIA_WARMUP_CONCURRENCY
+from database import get_media_files, save_media_file, delete_media_file
+
+logger = logging.getLogger(__name__)
+
+# 文件扩展名 -> Telegram 媒体类型（reply_<类型> / send_<类型> 的参数名）
+MEDIA_KINDS = {
+    ".mp4": "video",
+    ".jpg": "photo",
+    ".jpeg": "photo",
+    ".png": "photo",
+    ".gif": "animation",
+}
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def media_kind(path: str) -> str:
+    """按扩展名判断媒体类型"""
+    kind = MEDIA_KINDS.get(os.path.splitext(path)[1].lower())
+    if kind is None:
+        raise ValueError(f"不支持的媒体文件类型: {path}")
+    return kind
+
+
+def _read_file(full_path: str) -> Tuple[str, bytes]:
+    """读取文件内容并计算 SHA-256（在线程中执行）"""
+    digest = hashlib.sha256()
+    chunks = []
+    with open(full_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            chunks.append(chunk)
+    return digest.hexdigest(), b"".join(chunks)
+
+
+def _hash_file(full_path: str) -> str:
+    """只计算文件的 SHA-256，不保留内容（在线程中执行）"""
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sent_file_id(sent: Message, kind: str) -> Optional[str]:
+    """从发送结果中取出 file_id，照片取最大的尺寸"""
+    if kind == "photo":
+        return sent.photo[-1].file_id if sent.photo else None
+    # 没有声音的 mp4 可能被 Telegram 当作动图返回
+    media = getattr(sent, kind, None) or sent.animation or sent.document
+    return media.file_id if media else None
+
+
+def _is_file_id_rejected(error: BadRequest) -> bool:
+    """Telegram 拒绝 file_id（文件被删除、换了机器人等）时的错误，其他错误（如标题格式）不重新上传"""
+    return "file" in str(error).lower()
+
+
+class MediaRegistry:
+    """
+    媒体文件的 file_id 登记表
+
+    路径使用相对于 MEDIA_ROOT 的路径（如 "videos/dazuo.mp4"）。发送前用文件的 (修改时间, 大小)
+    判断内容是否可能变化，变化时才重新计算哈希；哈希与登记的一致时直接用 file_id 发送，不读取文件。
+    """
+
+    def __init__(self, root: str = MEDIA_ROOT):
+        self.root = root
+        self._file_ids: Dict[str, Tuple[str, str]] = {}          # 路径 -> (内容哈希, file_id)
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}       # 路径 -> (修改时间, 大小, 内容哈希)
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+        self._loaded = False
+
+    def full_path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    def _upload_lock(self, path: str) -> asyncio.Lock:
+        return self._upload_locks.setdefault(path, asyncio.Lock())
+
+    def discover(self, directories: Iterable[str] = MEDIA_DIRS) -> List[str]:
+        """列出目录中支持的媒体文件（相对路径）"""
+        paths = []
+        for directory in directories:
+            full_dir = self.full_path(directory)
+            if not os.path.isdir(full_dir):
+                continue
+            for name in sorted(os.listdir(full_dir)):
+                if os.path.splitext(name)[1].lower() in MEDIA_KINDS:
+                    paths.append(f"{directory}/{name}")
+        return paths
+
+    async def load(self) -> None:
+        """从数据库读取已登记的 file_id"""
+        self._file_ids = await get_media_files()
+        self._loaded = True
+        logger.info(f"已加载 {len(self._file_ids)} 个媒体文件的 file_id")
+
+    async def content_hash(self, path: str) -> str:
+        """文件当前内容的哈希，(修改时间, 大小) 不变时使用上次的结果"""
+        full_path = self.full_path(path)
+        stat = os.stat(full_path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        content_hash = await asyncio.to_thread(_hash_file, full_path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return content_hash
+
+    async def file_id(self, path: str) -> Optional[str]:
+        """登记的 file_id，文件内容已经变化时返回 None"""
+        if not self._loaded:
+            await self.load()
+        entry = self._file_ids.get(path)
+        if entry is None:
+            return None
+        content_hash, file_id = entry
+        return file_id if content_hash == await self.content_hash(path) else None
+
+    async def forget(self, path: str) -> None:
+        """删除失效的 file_id"""
+        if self._file_ids.pop(path, None) is not None:
+            await delete_media_file(path)
+
+    async def upload(self, path: str, send: Callable[..., Awaitable[Message]], **kwargs: Any) -> Message:
+        """
+        上传文件并登记返回的 file_id
+        send 为 reply_<类型> 或 send_<类型> 等发送方法，文件在线程中读取，不阻塞事件循环
+        """
+        kind = media_kind(path)
+        full_path = self.full_path(path)
+        stat = os.stat(full_path)
+        content_hash, data = await asyncio.to_thread(_read_file, full_path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+
+        sent = await send(**{kind: data}, filename=os.path.basename(path), **kwargs)
+        file_id = _sent_file_id(sent, kind)
+        if file_id:
+            self._file_ids[path] = (content_hash, file_id)
+            await save_media_file(path, content_hash, file_id)
+            logger.info(f"媒体文件已上传: {path} ({len(data)} 字节)")
+        else:
+            logger.warning(f"媒体文件上传后没有返回 file_id: {path}")
+        return sent
+
+    async def send(self, path: str, send: Callable[..., Awaitable[Message]], **kwargs: Any) -> Message:
+        """
+        发送媒体文件：已登记且内容未变化时用 file_id 发送，否则上传；
+        file_id 被 Telegram 拒绝时删除登记并重新上传一次
+        """
+        kind = media_kind(path)
+        file_id = await self.file_id(path)
+        if file_id:
+            try:
+                return await send(**{kind: file_id}, **kwargs)
+            except BadRequest as e:
+                if not _is_file_id_rejected(e):
+                    raise
+                logger.warning(f"file_id 已失效，重新上传 {path}: {e}")
+                await self.forget(path)
+
+        # 同一文件同时只上传一次，等待中的请求在上传完成后直接使用新的 file_id
+        async with self._upload_lock(path):
+            file_id = await self.file_id(path)
+            if file_id:
+                return await send(**{kind: file_id}, **kwargs)
+            return await self.upload(path, send, **kwargs)
+
+    async def reply(self, message: Message, path: str, **kwargs: Any) -> Message:
+        """回复一条消息并附带媒体文件，例如 reply(message, "videos/dazuo.mp4", caption=...)"""
+        return await self.send(path, getattr(message, f"reply_{media_kind(path)}"), **kwargs)
+
+    async def warm_up(
+        self,
+        bot: Any,
+        cache_chat_id: Optional[int],
+        directories: Iterable[str] = MEDIA_DIRS,
+        concurrency: int = MEDIA_WARMUP_CONCURRENCY
+    ) -> Dict[str, int]:
+        """
+        启动预热：并发读取目录中的全部媒体文件，把没有 file_id 或内容已变化的文件上传到
+        cache_chat_id 对应的聊天，使部署后的第一个请求也能直接用 file_id 发送
+
+        cache_chat_id 为 None 时只读取文件、计算哈希，不上传。单个文件失败只记录日志，不影响启动
+        返回各结果的文件数量：cached / uploaded / skipped / failed
+        """
+        if not self._loaded:
+            await self.load()
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+        counts = {"cached": 0, "uploaded": 0, "skipped": 0, "failed": 0}
+
+        async def prepare(path: str) -> None:
+            async with semaphore:
+                try:
+                    async with self._upload_lock(path):
+                        # 先读取一遍文件计算哈希，之后的请求只需要检查 (修改时间, 大小)
+                        await self.content_hash(path)
+                        if await self.file_id(path):
+                            counts["cached"] += 1
+                        elif cache_chat_id is None:
+                            counts["skipped"] += 1
+                        else:
+                            send = getattr(bot, f"send_{media_kind(path)}")
+                            await self.upload(path, send, chat_id=cache_chat_id, disable_notification=True)
+                            counts["uploaded"] += 1
+                except Exception as e:
+                    counts["failed"] += 1
+                    logger.warning(f"媒体文件预热失败 {path}: {e}")
+
+        paths = self.discover(directories)
+        await asyncio.gather(*(prepare(path) for path in paths))
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"媒体预热完成: {len(paths)} 个文件，已有 file_id {counts['cached']} 个，"
+            f"上传 {counts['uploaded']} 个，未配置缓存聊天跳过 {counts['skipped']} 个，"
+            f"失败 {counts['failed']} 个，耗时 {elapsed:.2f} 秒"
+        )
+        return counts
+
+
+# 全局媒体登记表
+media_registry = MediaRegistry()
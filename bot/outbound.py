@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人发送队列
+所有回复和公告经过同一个队列发送，按 Telegram 的限制（每个聊天、全局每秒消息数）用令牌桶控制发送速度：
+- 玩家指令的回复优先于公告
+- 排队中发往同一聊天同一主题的连续文本消息合并成一条发送，合并后的消息只引用第一条回复的原消息
+- 指令回复用 submit_reply() 入队后立即返回，不占用更新处理的名额；队列（全局、单个聊天）满时直接拒绝，
+  避免一个繁忙的群组占满 concurrent_updates 的名额、拖慢其他群组；公告用 send() 在队列满时等待
+- 收到 429 时暂停该聊天 retry_after 秒，之后从队首重新发送
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from telegram import Chat, Message, ReplyParameters
+from telegram.error import RetryAfter
+
+from config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+    OUTBOUND_MAX_PENDING, OUTBOUND_MAX_PENDING_PER_CHAT, OUTBOUND_MAX_IN_FLIGHT, OUTBOUND_MAX_RETRIES,
+    OUTBOUND_COALESCE_CHARS
+)
+from bot.media import media_kind, media_registry as default_media_registry
+
+logger = logging.getLogger(__name__)
+
+# 优先级：数值小的先发送
+REPLY = 0
+ANNOUNCEMENT = 1
+
+COALESCE_SEPARATOR = "\n\n"
+
+
+class OutboxFull(Exception):
+    """发送队列已满，消息没有入队"""
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 capacity 个，每条消息消耗一个"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """还要等待多少秒才有令牌"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until: float) -> None:
+        """暂停到 until，恢复后只有一个令牌，避免立即再次突发"""
+        if until > self.paused_until:
+            self.paused_until = until
+            self.tokens = 1.0
+            self.updated = until
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+@dataclass(eq=False)
+class OutboundMessage:
+    """队列中的一条消息，合并后的多条消息共用一次发送结果"""
+    chat_id: int
+    text: str
+    message_thread_id: Optional[int] = None
+    reply_to_message_id: Optional[int] = None
+    parse_mode: Optional[str] = None
+    media: Optional[str] = None
+    priority: int = REPLY
+    coalesce: bool = True
+    seq: int = 0
+    retries: int = 0
+    waiters: List[asyncio.Future] = field(default_factory=list)
+
+    def can_merge(self, other: 'OutboundMessage', max_chars: int) -> bool:
+        """
+        other 能否接在这条消息后面一起发送：都是允许合并的纯文本，发往同一聊天同一主题、格式相同
+        群组中每条回复引用的都是各自玩家的指令消息，因此不比较 reply_to_message_id，
+        合并后沿用这条消息的引用
+        """
+        return (
+            self.coalesce and other.coalesce
+            and self.media is None and other.media is None
+            and self.chat_id == other.chat_id
+            and self.message_thread_id == other.message_thread_id
+            and self.parse_mode == other.parse_mode
+            and len(self.text) + len(COALESCE_SEPARATOR) + len(other.text) <= max_chars
+        )
+
+
+class _ChatQueue:
+    """一个聊天的待发送消息（按优先级分队列）和令牌桶；同一聊天同时只发送一条，保证顺序"""
+
+    __slots__ = ("bucket", "queues", "busy")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.queues: Tuple[Deque[OutboundMessage], ...] = (deque(), deque())
+        self.busy = False
+
+    def head(self) -> Optional[OutboundMessage]:
+        for queue in self.queues:
+            if queue:
+                return queue[0]
+        return None
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self.queues)
+
+    def pop(self) -> OutboundMessage:
+        for queue in self.queues:
+            if queue:
+                return queue.popleft()
+        raise IndexError("聊天队列为空")
+
+
+class OutboundScheduler:
+    """
+    按 Telegram 发送限制调度消息
+
+    每次从令牌已就绪、当前没有在发送的聊天中选出 (优先级, 入队顺序) 最小的消息，
+    再取一个全局令牌后发送；最多同时发送 max_in_flight 条。
+    没有待发送消息且令牌桶已满的聊天会被删除，聊天表大小与活跃聊天数相当。
+    """
+
+    def __init__(
+        self,
+        media_registry: Any = default_media_registry,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        global_burst: float = OUTBOUND_GLOBAL_BURST,
+        chat_rate: float = OUTBOUND_CHAT_RATE,
+        chat_burst: float = OUTBOUND_CHAT_BURST,
+        max_pending: int = OUTBOUND_MAX_PENDING,
+        max_pending_per_chat: int = OUTBOUND_MAX_PENDING_PER_CHAT,
+        max_in_flight: int = OUTBOUND_MAX_IN_FLIGHT,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        coalesce_chars: int = OUTBOUND_COALESCE_CHARS
+    ):
+        self.media_registry = media_registry
+        self.bot: Any = None
+        self.global_bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.coalesce_chars = coalesce_chars
+        self.stats = {"sent": 0, "coalesced": 0, "retry_after": 0, "failed": 0, "rejected": 0}
+
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._pending = 0
+        self._in_flight = 0
+        self._seq = 0
+        self._space = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries: Set[asyncio.Task] = set()
+
+    def start(self, bot: Any) -> None:
+        """在事件循环中启动调度任务"""
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """等待队列中的消息发送完（最多 timeout 秒）后停止调度"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending or self._in_flight:
+            logger.warning(f"发送队列停止时仍有 {self._pending} 条消息未发送，{self._in_flight} 条正在发送")
+        self._task.cancel()
+        self._task = None
+
+    def _message(
+        self,
+        chat_id: int,
+        text: str,
+        message_thread_id: Optional[int],
+        reply_to_message_id: Optional[int],
+        parse_mode: Optional[str],
+        media: Optional[str],
+        priority: int,
+        coalesce: bool
+    ) -> OutboundMessage:
+        if self._task is None:
+            raise RuntimeError("发送队列尚未启动")
+        return OutboundMessage(
+            chat_id=chat_id,
+            text=text,
+            message_thread_id=message_thread_id,
+            reply_to_message_id=reply_to_message_id,
+            parse_mode=parse_mode,
+            media=media,
+            priority=priority,
+            coalesce=coalesce
+        )
+
+    def submit(
+        self,
+        chat_id: int,
+        text: str,
+        *,
+        message_thread_id: Optional[int] = None,
+        reply_to_message_id: Optional[int] = None,
+        parse_mode: Optional[str] = None,
+        media: Optional[str] = None,
+        priority: int = REPLY,
+        coalesce: bool = True
+    ) -> asyncio.Future:
+        """
+        把消息放入队列后立即返回，发送完成时 Future 得到 Telegram 的结果（合并发送时为合并后的消息）
+        队列已满时抛出 OutboxFull；media 为 MEDIA_ROOT 下的媒体文件路径，text 作为说明文字
+        """
+        message = self._message(
+            chat_id, text, message_thread_id, reply_to_message_id, parse_mode, media, priority, coalesce
+        )
+        future = asyncio.get_running_loop().create_future()
+        if not self._try_enqueue(message, future):
+            self.stats["rejected"] += 1
+            raise OutboxFull(f"发送队列已满 (chat_id: {chat_id})")
+        return future
+
+    async def send(
+        self,
+        chat_id: int,
+        text: str,
+        *,
+        message_thread_id: Optional[int] = None,
+        reply_to_message_id: Optional[int] = None,
+        parse_mode: Optional[str] = None,
+        media: Optional[str] = None,
+        priority: int = REPLY,
+        coalesce: bool = True
+    ) -> Message:
+        """与 submit 相同，但队列已满时等待空位，并等待发送完成"""
+        message = self._message(
+            chat_id, text, message_thread_id, reply_to_message_id, parse_mode, media, priority, coalesce
+        )
+        future = asyncio.get_running_loop().create_future()
+        async with self._space:
+            await self._space.wait_for(lambda: self._try_enqueue(message, future))
+        return await future
+
+    @staticmethod
+    def _reply_target(message: Message) -> Dict[str, Any]:
+        """与 message.reply_text 相同：群组中引用原消息，论坛主题中发到同一主题"""
+        return {
+            "message_thread_id": message.message_thread_id if message.is_topic_message else None,
+            "reply_to_message_id": message.message_id if message.chat.type != Chat.PRIVATE else None,
+        }
+
+    def submit_reply(
+        self,
+        message: Message,
+        text: str,
+        parse_mode: Optional[str] = None,
+        media: Optional[str] = None
+    ) -> asyncio.Future:
+        """回复一条消息，入队后立即返回（见 submit）"""
+        return self.submit(message.chat.id, text, parse_mode=parse_mode, media=media, **self._reply_target(message))
+
+    async def reply(
+        self,
+        message: Message,
+        text: str,
+        parse_mode: Optional[str] = None,
+        media: Optional[str] = None
+    ) -> Message:
+        """回复一条消息并等待发送完成（见 send）"""
+        return await self.send(message.chat.id, text, parse_mode=parse_mode, media=media, **self._reply_target(message))
+
+    async def announce(
+        self,
+        chat_id: int,
+        text: str,
+        message_thread_id: Optional[int] = None,
+        parse_mode: Optional[str] = None
+    ) -> Message:
+        """发送公告，优先级低于回复"""
+        return await self.send(
+            chat_id, text, message_thread_id=message_thread_id, parse_mode=parse_mode, priority=ANNOUNCEMENT
+        )
+
+    def _try_enqueue(self, message: OutboundMessage, future: asyncio.Future) -> bool:
+        """
+        入队或合并到队尾，队列已满时返回 False
+        同步执行，中间不会切换协程；入队只会减少空位，不需要通知等待中的 send()
+        """
+        chat = self._chats.get(message.chat_id)
+        queue = chat.queues[message.priority] if chat is not None else None
+        if queue and queue[-1].can_merge(message, self.coalesce_chars):
+            # 合并不占用新的位置，队列满时也可以
+            queue[-1].text += COALESCE_SEPARATOR + message.text
+            queue[-1].waiters.append(future)
+            self.stats["coalesced"] += 1
+            return True
+
+        # 公告最多占用一半队列，队列被公告占满时回复仍能入队
+        limit = self.max_pending if message.priority == REPLY else self.max_pending // 2
+        if self._pending >= limit or (chat is not None and chat.pending() >= self.max_pending_per_chat):
+            return False
+
+        if chat is None:
+            chat = self._chats[message.chat_id] = _ChatQueue(
+                TokenBucket(self.chat_rate, self.chat_burst, time.monotonic())
+            )
+        self._seq += 1
+        message.seq = self._seq
+        message.waiters.append(future)
+        chat.queues[message.priority].append(message)
+        self._pending += 1
+        self._wakeup.set()
+        return True
+
+    async def _requeue(self, chat: _ChatQueue, message: OutboundMessage) -> None:
+        """429 后放回队首重试，不受队列上限限制（消息本来就在队列中）"""
+        async with self._space:
+            chat.queues[message.priority].appendleft(message)
+            self._pending += 1
+        self._wakeup.set()
+
+    async def _take(self, chat: _ChatQueue) -> OutboundMessage:
+        """取出下一条要发送的消息，空出的位置通知等待中的 send()"""
+        async with self._space:
+            message = chat.pop()
+            self._pending -= 1
+            self._space.notify_all()
+        return message
+
+    def _select(self, now: float) -> Tuple[Optional[_ChatQueue], Optional[float]]:
+        """选出下一条要发送的消息所在的聊天；没有可发送的聊天时返回最短等待时间（None 表示等待新消息）"""
+        best, best_key, wait = None, None, None
+        idle = []
+        for chat_id, chat in self._chats.items():
+            if chat.busy:
+                continue
+            head = chat.head()
+            if head is None:
+                if chat.bucket.full(now):
+                    idle.append(chat_id)
+                continue
+            delay = chat.bucket.delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            key = (head.priority, head.seq)
+            if best_key is None or key < best_key:
+                best, best_key = chat, key
+        for chat_id in idle:
+            del self._chats[chat_id]
+        return best, wait
+
+    async def _wait(self, timeout: Optional[float]) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if self._in_flight >= self.max_in_flight:
+                await self._wait(None)
+                continue
+            chat, wait = self._select(now)
+            if chat is None:
+                await self._wait(wait)
+                continue
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                # 等待期间可能有更高优先级的回复入队，醒来后重新选择
+                await self._wait(delay)
+                continue
+
+            chat.busy = True
+            message = await self._take(chat)
+            chat.bucket.take(now)
+            self.global_bucket.take(now)
+            self._in_flight += 1
+            task = asyncio.create_task(self._deliver(chat, message))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, chat: _ChatQueue, message: OutboundMessage) -> None:
+        try:
+            sent = await self._send(message)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+            self.stats["retry_after"] += 1
+            chat.bucket.pause(time.monotonic() + seconds)
+            if message.retries < self.max_retries:
+                message.retries += 1
+                await self._requeue(chat, message)
+                logger.warning(f"聊天 {message.chat_id} 发送过快，{seconds:.0f} 秒后重试")
+            else:
+                self._fail(message, e)
+        except Exception as e:
+            self._fail(message, e)
+        else:
+            self.stats["sent"] += 1
+            for waiter in message.waiters:
+                if not waiter.done():
+                    waiter.set_result(sent)
+        finally:
+            chat.busy = False
+            self._in_flight -= 1
+            self._wakeup.set()
+
+    def _fail(self, message: OutboundMessage, error: Exception) -> None:
+        self.stats["failed"] += 1
+        logger.error(f"发送消息到聊天 {message.chat_id} 失败: {error}")
+        for waiter in message.waiters:
+            if not waiter.done():
+                waiter.set_exception(error)
+
+    async def _send(self, message: OutboundMessage) -> Message:
+        kwargs: Dict[str, Any] = {
+            "chat_id": message.chat_id,
+            "message_thread_id": message.message_thread_id,
+            "parse_mode": message.parse_mode,
+        }
+        if message.reply_to_message_id is not None:
+            # 排队期间原消息可能已被删除，此时不引用直接发送
+            kwargs["reply_parameters"] = ReplyParameters(
+                message.reply_to_message_id, allow_sending_without_reply=True
+            )
+        if message.media:
+            send = getattr(self.bot, f"send_{media_kind(message.media)}")
+            return await self.media_registry.send(message.media, send, caption=message.text, **kwargs)
+        return await self.bot.send_message(text=message.text, **kwargs)
+
+
+# 全局发送队列，在 on_startup 中随 Application 的 bot 启动
+outbox = OutboundScheduler()
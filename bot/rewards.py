@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人掉落引擎
+每张掉落表在加载游戏内容时编译成别名表（Vose alias method），之后每种物品只需一次随机数
+就能得到掉落数量（包括未掉落），与物品的数量范围大小无关；批量掷骰和逐次掷骰使用同样的别名表，
+给定相同种子的随机数流时结果完全一致
+"""
+
+import random
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Sequence, Tuple, Any
+
+
+class AliasTable:
+    """
+    离散分布的别名表：O(n) 构建，每次抽样 O(1)
+
+    把 n 个结果各自的概率放进 n 个等宽的桶里，每个桶最多装两个结果：
+    随机选一个桶，再用同一个随机数的小数部分决定取桶的本来结果还是别名结果。
+    """
+
+    __slots__ = ("outcomes", "prob", "alias")
+
+    def __init__(self, outcomes: Sequence[int], weights: Sequence[float]):
+        if not outcomes or len(outcomes) != len(weights):
+            raise ValueError("别名表需要一一对应的结果和权重")
+        total = float(sum(weights))
+        if total <= 0 or any(weight < 0 for weight in weights):
+            raise ValueError(f"别名表的权重必须非负且总和大于 0: {weights}")
+
+        n = len(outcomes)
+        scaled = [weight * n / total for weight in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less], alias[less] = scaled[less], more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # 剩下的桶由浮点误差产生，概率按 1 处理
+
+        self.outcomes: Tuple[int, ...] = tuple(outcomes)
+        self.prob: Tuple[float, ...] = tuple(prob)
+        self.alias: Tuple[int, ...] = tuple(alias)
+
+    def sample(self, rng: Any = random) -> int:
+        """抽样一次，只消耗一个随机数"""
+        u = rng.random() * len(self.prob)
+        index = int(u)
+        if u - index < self.prob[index]:
+            return self.outcomes[index]
+        return self.outcomes[self.alias[index]]
+
+    def sample_many(self, rng: Any, k: int) -> List[int]:
+        """连续抽样 k 次，与调用 k 次 sample 的结果相同"""
+        n = len(self.prob)
+        outcomes, prob, alias = self.outcomes, self.prob, self.alias
+        draws = []
+        for _ in range(k):
+            u = rng.random() * n
+            index = int(u)
+            draws.append(outcomes[index] if u - index < prob[index] else outcomes[alias[index]])
+        return draws
+
+
+def amount_table(low: int, high: int, chance: float = 1.0) -> AliasTable:
+    """以 chance 的概率掉落，数量在 [low, high] 之间均匀分布；未掉落时数量为 0"""
+    amounts = list(range(low, high + 1))
+    weights = [chance / len(amounts)] * len(amounts)
+    if chance < 1:
+        amounts.append(0)
+        weights.append(1 - chance)
+    return AliasTable(amounts, weights)
+
+
+@dataclass(frozen=True, slots=True)
+class Drop:
+    """掉落表中的一种物品"""
+    name: str
+    amounts: AliasTable
+
+
+class LootRoll(NamedTuple):
+    """一次掷骰的结果，items 只包含数量大于 0 的物品"""
+    exp: int
+    items: Dict[str, int]
+
+
+class LootBatch(NamedTuple):
+    """N 次掷骰的结果，按列存放：exp[i]、items[name][i] 是第 i 次的经验和物品数量"""
+    exp: List[int]
+    items: Dict[str, List[int]]
+
+    def totals(self) -> LootRoll:
+        """N 次掷骰的合计"""
+        items = {name: sum(amounts) for name, amounts in self.items.items()}
+        return LootRoll(sum(self.exp), {name: amount for name, amount in items.items() if amount > 0})
+
+
+@dataclass(frozen=True, slots=True)
+class LootTable:
+    """编译后的掉落表：经验范围 + 每种物品一张别名表"""
+    exp: Tuple[int, int]
+    drops: Tuple[Drop, ...]
+
+    def roll(self, rng: Any = random) -> LootRoll:
+        """掷骰一次：经验一个随机数，每种物品一个随机数"""
+        items = {}
+        for drop in self.drops:
+            amount = drop.amounts.sample(rng)
+            if amount > 0:
+                items[drop.name] = amount
+        return LootRoll(rng.randint(*self.exp), items)
+
+    def roll_batch(self, rng: Any, n: int) -> LootBatch:
+        """
+        批量掷骰 n 次，供批量操作和数值模拟使用
+        每次按 roll() 的顺序消耗随机数（先物品后经验），与连续调用 n 次 roll() 的结果相同
+        """
+        low, high = self.exp
+        exp: List[int] = []
+        items: Dict[str, List[int]] = {drop.name: [] for drop in self.drops}
+        columns = [(drop.amounts, items[drop.name]) for drop in self.drops]
+        for _ in range(n):
+            for amounts, column in columns:
+                column.append(amounts.sample(rng))
+            exp.append(rng.randint(low, high))
+        return LootBatch(exp, items)
+
+
+def compile_loot(
+    exp: Tuple[int, int],
+    ranges: Sequence[Tuple[str, int, int]],
+    chance: float = 1.0,
+    rare_items: Sequence[Tuple[str, float]] = ()
+) -> LootTable:
+    """
+    编译掉落表：ranges 中每种物品以 chance 的概率掉落 [low, high] 个，
+    rare_items 中每种物品按各自的概率掉落 1 个
+    """
+    drops = [Drop(name, amount_table(low, high, chance)) for name, low, high in ranges]
+    drops.extend(Drop(name, amount_table(1, 1, rare_chance)) for name, rare_chance in rare_items)
+    return LootTable(exp, tuple(drops))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人随机数服务
+每名玩家的每种动作使用独立的随机数流，第 n 次动作的随机数流由 (种子, 纪元, 代, 玩家, 动作, n) 唯一确定，
+与其他玩家的请求如何交错无关；纪元默认每次启动随机生成，重启后不会重放之前的随机数流，
+固定种子和纪元后压测和问题重现可以逐位复现
+"""
+
+import hashlib
+import logging
+import random
+import secrets
+from typing import Dict, Optional, Tuple
+
+from config import GAME_RNG_SEED, GAME_RNG_EPOCH, GAME_RNG_MAX_COUNTERS
+
+logger = logging.getLogger(__name__)
+
+
+class RngService:
+    """
+    基于计数器的随机数流
+
+    stream(user_id, action) 每次调用把 (user_id, action) 的计数器加一，用 BLAKE2b 把
+    (种子, 纪元, 代, user_id, action, 计数器) 散列成 128 位种子，返回一个新的 random.Random。
+    不同玩家、不同动作之间互不影响；已知种子、纪元、代和计数器时可以单独重放某一次动作。
+
+    计数器表达到 max_counters 个时清空并进入下一代：计数器从 0 重新开始，但散列的键不同，
+    不会重复之前的随机数流，计数器表的内存也不会随玩家数量无限增长。
+    """
+
+    def __init__(
+        self,
+        seed: Optional[int] = GAME_RNG_SEED,
+        epoch: Optional[int] = GAME_RNG_EPOCH,
+        max_counters: int = GAME_RNG_MAX_COUNTERS
+    ):
+        if seed is None:
+            seed = secrets.randbits(64)
+        if epoch is None:
+            epoch = secrets.randbits(64)
+        self.seed = seed
+        self.epoch = epoch
+        self.generation = 0
+        self.max_counters = max(1, max_counters)
+        self._counters: Dict[Tuple[int, str], int] = {}
+        logger.info(f"随机数种子: {seed}，纪元: {epoch}")
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def counter(self, user_id: int, action: str) -> int:
+        """(user_id, action) 在当前代已经生成的随机数流数量，即下一次动作的计数器"""
+        return self._counters.get((user_id, action), 0)
+
+    def _next_generation(self) -> None:
+        self.generation += 1
+        self._counters.clear()
+        logger.info(f"随机数计数器达到 {self.max_counters} 个，进入第 {self.generation} 代")
+
+    def stream(
+        self,
+        user_id: int,
+        action: str,
+        counter: Optional[int] = None,
+        generation: Optional[int] = None
+    ) -> random.Random:
+        """
+        玩家一次动作使用的随机数流
+
+        不指定 counter 时使用并递增该玩家该动作在当前代的计数器；
+        指定 counter（和 generation，默认为当前代）时只生成对应的随机数流，不改变计数器
+        """
+        if counter is None:
+            key = (user_id, action)
+            counter = self._counters.get(key)
+            if counter is None:
+                if len(self._counters) >= self.max_counters:
+                    self._next_generation()
+                counter = 0
+            self._counters[key] = counter + 1
+            generation = self.generation
+        elif generation is None:
+            generation = self.generation
+        digest = hashlib.blake2b(
+            f"{self.seed}:{self.epoch}:{generation}:{user_id}:{action}:{counter}".encode('utf-8'),
+            digest_size=16
+        ).digest()
+        return random.Random(int.from_bytes(digest, 'big'))
@@ -24,9 +24,53 @@ TELEGRAM_BOT_TOKEN = "7959010529:AAFNsquVMC_IrYyoD_b4uAflWxMl3nIVheg"  # 替换
 # SQLite 数据库文件路径
 DATABASE_PATH = "xiuxian_game.db"
 
+# 游戏内容文件（药园、矿洞、秘境、武器、强化等数值配置）
+GAME_CONTENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "content.json")
+
+# 媒体文件（images/、videos/）所在目录，上传后的 file_id 保存在数据库的 media_files 表中
+MEDIA_ROOT = os.path.dirname(os.path.abspath(__file__))
+MEDIA_DIRS = ("images", "videos")
+# 启动时把媒体文件上传到这个聊天（建议使用机器人所在的私有频道）以获取 file_id，None 表示不预先上传
+MEDIA_CACHE_CHAT_ID = None
+MEDIA_WARMUP_CONCURRENCY = 4       # 预热时同时读取/上传的文件数量
+
 # 数据库连接池配置
 DB_POOL_SIZE = 10
 DB_TIMEOUT = 30.0
+# 空闲超过该秒数的连接在复用前先执行一次健康检查
+DB_HEALTH_CHECK_INTERVAL = 60.0
+
+# SQLite PRAGMA 配置档，连接池中的每个连接创建时都会应用
+# default 保持 SQLite 默认的回滚日志模式；wal 允许读写并发，写事务不再阻塞读
+DB_PRAGMA_PROFILE = "wal"
+DB_PRAGMA_PROFILES: Dict[str, Dict[str, object]] = {
+    "default": {},
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",      # WAL 下只在检查点时 fsync，断电最多丢失最近的事务
+        "cache_size": -65536,         # 负数单位为 KiB，即每个连接 64MB 页缓存
+        "mmap_size": 268435456,       # 256MB 内存映射读取
+        "temp_store": "MEMORY",
+        "busy_timeout": int(DB_TIMEOUT * 1000),
+    },
+    "wal_full": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",        # 每次提交都 fsync，最安全也最慢
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": int(DB_TIMEOUT * 1000),
+    },
+}
+
+# 写入合并配置（group commit，并发的玩家写入合并到一个事务）
+DB_WRITE_BATCH_DELAY = 0.002         # 收集写入的最长等待时间（秒）
+DB_WRITE_BATCH_SIZE = 500            # 每个事务最多合并的写入数量
+
+# 玩家缓存配置（写回缓存，热点玩家读写不落盘）
+PLAYER_CACHE_MAX_SIZE = 10000        # 最多缓存的玩家数量
+PLAYER_CACHE_FLUSH_INTERVAL = 5.0    # 定时刷盘间隔（秒）
+PLAYER_CACHE_FLUSH_THRESHOLD = 200   # 脏数据达到该数量时立即刷盘
 
 # =============================================================================
 # 频道和权限配置
@@ -64,6 +108,38 @@ COOLDOWN_TIMES = {
     "challenge": 600       # 副本挑战冷却时间
 }
 
+# 战斗日志配置（Telegram 单条消息最多 4096 字符，日志之外还要留出奖励信息的位置）
+BATTLE_LOG_MAX_BYTES = 3000          # 战斗日志最多占用的字节数（UTF-8）
+BATTLE_LOG_HEAD_EVENTS = 4           # 每场交战保留开头的出手记录条数
+BATTLE_LOG_TAIL_EVENTS = 4           # 每场交战保留结尾的出手记录条数
+
+# 随机数设置
+# 固定种子和纪元后所有玩家的采药、打坐、采矿、秘境和强化结果都可以复现（压测、重现问题），
+# None 表示启动时随机生成（会写入日志）。线上只固定种子、不固定纪元，否则每次重启都会重放同样的随机结果
+GAME_RNG_SEED = None
+GAME_RNG_EPOCH = None
+GAME_RNG_MAX_COUNTERS = 100000       # 计数器表的上限（每个玩家每种动作一个），超过后换一代重新计数
+
+# 指令处理设置
+COMMAND_FLOOD_LIMIT = 5             # 每名玩家在 COMMAND_FLOOD_WINDOW 秒内最多处理的指令数，超出的指令直接忽略
+COMMAND_FLOOD_WINDOW = 10
+COMMAND_SLOW_SECONDS = 2.0          # 指令处理（到回复放入发送队列为止）超过这个时间时记录警告
+UPDATE_CONCURRENCY = 256            # 同时处理的更新数量上限（同一玩家的指令仍依次处理）
+
+# 发送队列设置（Telegram 限制：全局每秒约 30 条，同一群组每分钟 20 条；速度略低于限制，抵消网络抖动）
+OUTBOUND_GLOBAL_RATE = 28.0         # 全局每秒发送的消息数
+OUTBOUND_GLOBAL_BURST = 30          # 全局最多连续突发的消息数
+OUTBOUND_CHAT_RATE = 19 / 60        # 每个聊天每秒发送的消息数
+OUTBOUND_CHAT_BURST = 3             # 每个聊天最多连续突发的消息数
+# 同一群组的回复按 OUTBOUND_CHAT_RATE 发送：突发 3 条之后约每 3.2 秒一条，
+# 排在第 n 条的回复大约要等 (n - 3) * 3.2 秒；单个群组最多排队 OUTBOUND_MAX_PENDING_PER_CHAT 条（约 3 分钟），
+# 超出的回复直接丢弃（记录警告），指令处理不会因为等待发送而占用 UPDATE_CONCURRENCY 的名额
+OUTBOUND_MAX_PENDING = 1000         # 全部聊天的排队消息上限（公告最多占一半）
+OUTBOUND_MAX_PENDING_PER_CHAT = 60  # 单个聊天的排队消息上限
+OUTBOUND_MAX_IN_FLIGHT = 16         # 同时发送中的请求数
+OUTBOUND_MAX_RETRIES = 3            # 收到 429 后最多重试次数
+OUTBOUND_COALESCE_CHARS = 4096      # 合并后的消息最大长度（Telegram 单条消息上限）
+
 # 日志配置
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
@@ -5,57 +5,553 @@
 """
 
 import aiosqlite
+import asyncio
 import json
 import logging
-from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from pathlib import Path
 
-from models.player_data import PlayerData
-from config import DATABASE_PATH, DB_TIMEOUT
+from models.player_data import PlayerData, ITEMS_BAG, MATERIALS_BAG, TIME_FIELDS, now_ms, to_epoch_ms
+from player_cache import PlayerCache
+from leaderboard import Leaderboard, LeaderboardEntry
+from config import (
+    DATABASE_PATH, DB_TIMEOUT, DB_POOL_SIZE, DB_HEALTH_CHECK_INTERVAL,
+    DB_PRAGMA_PROFILE, DB_PRAGMA_PROFILES, DB_WRITE_BATCH_DELAY, DB_WRITE_BATCH_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
+# update_player 可以更新的列，顺序与建表语句一致
+PLAYER_UPDATE_COLUMNS = (
+    'username',
+    'screen_name',
+    'realm',
+    'exp',
+    'spiritual_power_base',
+    'max_spiritual_power',
+    'max_hp',
+    'attack',
+    'defense',
+    'equipped_weapon',
+    'last_meditation_time_ms',
+    'last_herb_gathering_time_ms',
+    'last_mining_time_ms',
+    'last_challenge_time_ms',
+    'spirit_anchor_ms',
+)
+
+# 数据库结构版本，保存在 PRAGMA user_version 中
+# 1: 背包从 players.items JSON 拆分到 player_materials / player_weapons 表
+# 2: 时间列从 ISO 字符串改为整数毫秒时间戳（*_ms 列）
+# 3: 灵力改为 (spiritual_power_base, spirit_anchor_ms)，读取时计算自然恢复
+SCHEMA_VERSION = 3
+
+# 玩家表，时间列保存 UTC 毫秒时间戳
+CREATE_PLAYERS_SQL = """
+    CREATE TABLE IF NOT EXISTS players (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        screen_name TEXT NOT NULL,
+        realm TEXT DEFAULT '练气期',
+        exp INTEGER DEFAULT 0,
+        spiritual_power_base INTEGER DEFAULT 100,
+        max_spiritual_power INTEGER DEFAULT 100,
+        max_hp INTEGER DEFAULT 100,
+        attack INTEGER DEFAULT 10,
+        defense INTEGER DEFAULT 5,
+        items TEXT DEFAULT '{}',  -- 旧版JSON背包，已迁移到背包表
+        equipped_weapon TEXT,
+        last_meditation_time_ms INTEGER,
+        last_herb_gathering_time_ms INTEGER,
+        last_mining_time_ms INTEGER,
+        last_challenge_time_ms INTEGER,
+        spirit_anchor_ms INTEGER,
+        created_at_ms INTEGER DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
+        updated_at_ms INTEGER DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
+    )
+"""
+
+# 迁移时间列时原样复制的列：旧列名 -> 新列名
+PLAYER_COPY_COLUMNS = {
+    'user_id': 'user_id',
+    'username': 'username',
+    'screen_name': 'screen_name',
+    'realm': 'realm',
+    'exp': 'exp',
+    'spiritual_power': 'spiritual_power_base',
+    'max_spiritual_power': 'max_spiritual_power',
+    'max_hp': 'max_hp',
+    'attack': 'attack',
+    'defense': 'defense',
+    'items': 'items',
+    'equipped_weapon': 'equipped_weapon',
+}
+
+# 迁移时每批处理的玩家数量
+MIGRATION_BATCH_SIZE = 500
+
+# player_weapons 表中保存的武器属性列
+WEAPON_COLUMNS = (
+    'name',
+    'type',
+    'attack',
+    'rarity',
+    'description',
+    'price',
+    'required_realm',
+    'enhancement_level',
+    'acquired_at',
+)
+
+# 材料按增量写入，不存在时插入
+UPSERT_MATERIAL_SQL = """
+    INSERT INTO player_materials (user_id, bag, item_id, qty) VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id, bag, item_id) DO UPDATE SET qty = qty + excluded.qty
+"""
+
+# 武器整行覆盖
+UPSERT_WEAPON_SQL = f"""
+    INSERT OR REPLACE INTO player_weapons (user_id, {', '.join(WEAPON_COLUMNS)})
+    VALUES (?, {', '.join('?' for _ in WEAPON_COLUMNS)})
+"""
+
+# 新玩家的初始属性，背包保存在 player_materials / player_weapons 表中，items 列只保留为空对象
+INSERT_PLAYER_SQL = """
+    INSERT INTO players (
+        user_id, username, screen_name, realm, exp,
+        spiritual_power_base, max_spiritual_power, max_hp,
+        attack, defense, items, spirit_anchor_ms, created_at_ms, updated_at_ms
+    ) VALUES (?, ?, ?, '练气期', 0, 100, 100, 100, 10, 5, '{}', ?, ?, ?)
+"""
+
+# INSERT ... RETURNING 需要 SQLite 3.35 及以上
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class ConnectionPool:
+    """
+    aiosqlite长连接池
+    连接按需创建，最多DB_POOL_SIZE个，用完归还复用，避免每次查询都新建线程和重新打开文件
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = DB_POOL_SIZE,
+        timeout: float = DB_TIMEOUT,
+        health_check_interval: float = DB_HEALTH_CHECK_INTERVAL,
+        pragmas: Optional[Dict[str, Any]] = None
+    ):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pragmas = dict(pragmas or {})
+        self._idle: List[aiosqlite.Connection] = []
+        self._last_used: Dict[int, float] = {}
+        self._created = 0
+        self._waiters: List[asyncio.Future] = []
+        self._closed = False
+
+    async def _open(self) -> aiosqlite.Connection:
+        """打开一个新连接"""
+        conn = await aiosqlite.connect(self.db_path, timeout=self.timeout)
+        conn.row_factory = aiosqlite.Row
+        try:
+            for name, value in self.pragmas.items():
+                async with conn.execute(f"PRAGMA {name} = {value}"):
+                    pass
+        except Exception:
+            await conn.close()
+            raise
+        return conn
+
+    async def _ping(self, conn: aiosqlite.Connection) -> bool:
+        """执行一次最简单的查询确认连接可用"""
+        try:
+            async with conn.execute("SELECT 1") as cursor:
+                await cursor.fetchone()
+            return True
+        except Exception as e:
+            logger.warning(f"数据库连接健康检查失败，丢弃连接: {e}")
+            return False
+
+    async def _is_healthy(self, conn: aiosqlite.Connection) -> bool:
+        """检查连接是否可用，只对空闲超过检查间隔的连接执行"""
+        last_used = self._last_used.get(id(conn), 0.0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        return await self._ping(conn)
+
+    async def _discard(self, conn: aiosqlite.Connection) -> None:
+        """关闭并丢弃一个连接，释放名额"""
+        self._last_used.pop(id(conn), None)
+        self._created -= 1
+        try:
+            await conn.close()
+        except Exception as e:
+            logger.debug(f"关闭数据库连接失败: {e}")
+        self._wake_waiter()
+
+    def _wake_waiter(self) -> None:
+        """唤醒一个等待连接的协程"""
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def acquire(self) -> aiosqlite.Connection:
+        """
+        获取一个连接：优先复用空闲连接，未达上限时新建，否则等待归还
+        """
+        while True:
+            if self._closed:
+                raise RuntimeError("数据库连接池已关闭")
+
+            if self._idle:
+                conn = self._idle.pop()
+                if await self._is_healthy(conn):
+                    return conn
+                await self._discard(conn)
+                continue
+
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return await self._open()
+                except Exception:
+                    self._created -= 1
+                    self._wake_waiter()
+                    raise
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"等待数据库连接超时 ({self.timeout}s)")
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    async def release(self, conn: aiosqlite.Connection, discard: bool = False) -> None:
+        """
+        归还连接；未提交的事务会被回滚，出错的连接直接丢弃
+        """
+        if discard or self._closed:
+            await self._discard(conn)
+            return
+
+        if conn.in_transaction:
+            try:
+                await conn.rollback()
+            except Exception as e:
+                logger.warning(f"回滚未提交事务失败，丢弃连接: {e}")
+                await self._discard(conn)
+                return
+
+        self._last_used[id(conn)] = time.monotonic()
+        self._idle.append(conn)
+        self._wake_waiter()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        以上下文管理器的方式借用连接
+        """
+        conn = await self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # 出错后确认连接是否仍然可用，损坏的连接不再放回池中
+            await self.release(conn, discard=not await self._ping(conn))
+            raise
+        else:
+            await self.release(conn)
+
+    async def close(self) -> None:
+        """
+        关闭所有空闲连接，之后借出的连接在归还时关闭
+        """
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await self._discard(conn)
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+@dataclass
+class PlayerWrite:
+    """
+    一次玩家写入的快照：提交时的列值、材料增量和武器变化
+    """
+    user_id: int
+    updated_at_ms: int = 0
+    columns: Dict[str, Any] = field(default_factory=dict)
+    material_deltas: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    weapons: Dict[str, Optional[tuple]] = field(default_factory=dict)  # None 表示删除
+
+    def merge(self, other: "PlayerWrite") -> None:
+        """合并同一玩家之后的一次写入：列值和武器以后者为准，材料增量累加"""
+        self.updated_at_ms = other.updated_at_ms or self.updated_at_ms
+        self.columns.update(other.columns)
+        for key, amount in other.material_deltas.items():
+            self.material_deltas[key] = self.material_deltas.get(key, 0) + amount
+        self.weapons.update(other.weapons)
+
+
+class WriteCoalescer:
+    """
+    玩家写入合并器（group commit）
+
+    并发的 update_player 不再各自提交事务，而是先进入队列；
+    写入任务最多等待 max_delay 秒或凑满 max_batch 条，然后在一个事务里用 executemany 写入整批，
+    提交成功后再唤醒各自的调用者。同一批中同一玩家的多次写入会先合并成一条。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        max_delay: float = DB_WRITE_BATCH_DELAY,
+        max_batch: int = DB_WRITE_BATCH_SIZE
+    ):
+        self.pool = pool
+        self.max_delay = max(0.0, max_delay)
+        self.max_batch = max(1, max_batch)
+        self._queue: List[Tuple[PlayerWrite, asyncio.Future]] = []
+        self._pending: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.batches = 0
+        self.writes = 0
+
+    def _ensure_task(self) -> None:
+        """按需启动写入任务（事件循环变化后重新创建）"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._pending = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, write: PlayerWrite) -> None:
+        """
+        提交一次写入，等到所在的事务提交后返回；写入失败时抛出异常
+        """
+        self._ensure_task()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((write, future))
+        self._pending.set()
+        if len(self._queue) >= self.max_batch:
+            self._full.set()
+        await future
+
+    async def _run(self) -> None:
+        """写入任务：收集一批写入后统一提交"""
+        while True:
+            await self._pending.wait()
+            if not self._queue and self._closing:
+                return
+
+            # 等待更多写入加入本批，凑满或关闭时立即提交
+            if len(self._queue) < self.max_batch and not self._closing and self.max_delay > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            if len(self._queue) < self.max_batch:
+                self._full.clear()
+            if not self._queue and not self._closing:
+                self._pending.clear()
+
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: List[Tuple[PlayerWrite, asyncio.Future]]) -> None:
+        """提交一批写入并通知调用者；整批失败时逐条重试，避免一条坏数据拖累整批"""
+        try:
+            await self._write([write for write, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                logger.error(f"批量写入玩家数据失败，逐条重试 ({len(batch)} 条): {e}")
+                for item in batch:
+                    await self._commit_batch([item])
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def _write(self, writes: List[PlayerWrite]) -> None:
+        """在一个事务中写入一批玩家数据"""
+        merged: Dict[int, PlayerWrite] = {}
+        for write in writes:
+            target = merged.get(write.user_id)
+            if target is None:
+                target = merged[write.user_id] = PlayerWrite(write.user_id)
+            target.merge(write)
+
+        # 修改了相同列的玩家共用一条 UPDATE 语句
+        updates: Dict[Tuple[str, ...], List[list]] = {}
+        material_rows = []
+        weapon_rows = []
+        removed_rows = []
+        for write in merged.values():
+            columns = tuple(name for name in PLAYER_UPDATE_COLUMNS if name in write.columns)
+            updates.setdefault(columns, []).append(
+                [write.columns[name] for name in columns] + [write.updated_at_ms, write.user_id]
+            )
+            material_rows.extend(
+                (write.user_id, bag, item, amount)
+                for (bag, item), amount in write.material_deltas.items()
+                if amount
+            )
+            for name, row in write.weapons.items():
+                if row is None:
+                    removed_rows.append((write.user_id, name))
+                else:
+                    weapon_rows.append(row)
+
+        async with self.pool.connection() as db:
+            try:
+                for columns, rows in updates.items():
+                    set_clause = ", ".join(f"{name} = ?" for name in columns + ('updated_at_ms',))
+                    await db.executemany(f"UPDATE players SET {set_clause} WHERE user_id = ?", rows)
+                if material_rows:
+                    await db.executemany(UPSERT_MATERIAL_SQL, material_rows)
+                if weapon_rows:
+                    await db.executemany(UPSERT_WEAPON_SQL, weapon_rows)
+                if removed_rows:
+                    await db.executemany(
+                        "DELETE FROM player_weapons WHERE user_id = ? AND name = ?",
+                        removed_rows
+                    )
+                await db.commit()
+            except Exception:
+                try:
+                    await db.rollback()
+                except Exception:
+                    pass
+                raise
+
+    async def close(self) -> None:
+        """
+        提交队列中剩余的写入，然后停止写入任务
+        """
+        if self._task is None or self._task.done():
+            return
+        self._closing = True
+        self._pending.set()
+        self._full.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+            self._closing = False
+
+
 class Database:
     """
     异步SQLite数据库管理类
     """
     
-    def __init__(self, db_path: str = DATABASE_PATH):
+    def __init__(
+        self,
+        db_path: str = DATABASE_PATH,
+        pool_size: int = DB_POOL_SIZE,
+        pragma_profile: str = DB_PRAGMA_PROFILE
+    ):
+        if pragma_profile not in DB_PRAGMA_PROFILES:
+            raise ValueError(f"未知的PRAGMA配置档: {pragma_profile}")
+
         self.db_path = db_path
         self.timeout = DB_TIMEOUT
+        self.pool_size = pool_size
+        self.pragma_profile = pragma_profile
+        self.pool = self._create_pool()
+        self.writer = WriteCoalescer(self.pool)
+
+    def _create_pool(self) -> ConnectionPool:
+        """按当前配置创建连接池"""
+        return ConnectionPool(
+            self.db_path,
+            size=self.pool_size,
+            timeout=self.timeout,
+            pragmas=DB_PRAGMA_PROFILES[self.pragma_profile]
+        )
         
     async def init_database(self) -> None:
         """
         初始化数据库，创建必要的表
         """
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            async with self.pool.connection() as db:
                 # 创建玩家表
+                await db.execute(CREATE_PLAYERS_SQL)
+
+                # 创建材料表，bag 为背包分区：items / materials / 嵌套分区（如 challenge）
                 await db.execute("""
-                    CREATE TABLE IF NOT EXISTS players (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT NOT NULL,
-                        screen_name TEXT NOT NULL,
-                        realm TEXT DEFAULT '练气期',
-                        exp INTEGER DEFAULT 0,
-                        spiritual_power INTEGER DEFAULT 100,
-                        max_spiritual_power INTEGER DEFAULT 100,
-                        max_hp INTEGER DEFAULT 100,
-                        attack INTEGER DEFAULT 10,
-                        defense INTEGER DEFAULT 5,
-                        items TEXT DEFAULT '{}',  -- JSON格式存储物品
-                        equipped_weapon TEXT,
-                        last_meditation_time TEXT,
-                        last_herb_gathering_time TEXT,
-                        last_mining_time TEXT,
-                        last_challenge_time TEXT,
-                        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                    )
+                    CREATE TABLE IF NOT EXISTS player_materials (
+                        user_id INTEGER NOT NULL,
+                        bag TEXT NOT NULL,
+                        item_id TEXT NOT NULL,
+                        qty INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, bag, item_id)
+                    ) WITHOUT ROWID
+                """)
+
+                await db.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_player_materials_item
+                    ON player_materials(item_id)
+                """)
+
+                # 创建武器表
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS player_weapons (
+                        user_id INTEGER NOT NULL,
+                        name TEXT NOT NULL,
+                        type TEXT DEFAULT '武器',
+                        attack INTEGER DEFAULT 0,
+                        rarity TEXT DEFAULT '普通',
+                        description TEXT DEFAULT '',
+                        price INTEGER DEFAULT 0,
+                        required_realm TEXT DEFAULT '练气期',
+                        enhancement_level INTEGER DEFAULT 0,
+                        acquired_at TEXT,
+                        PRIMARY KEY (user_id, name)
+                    ) WITHOUT ROWID
+                """)
+
+                # 创建媒体文件表：已上传到 Telegram 的图片/视频，content_hash 对应上传时的文件内容
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS media_files (
+                        path TEXT PRIMARY KEY,
+                        content_hash TEXT NOT NULL,
+                        file_id TEXT NOT NULL,
+                        updated_at_ms INTEGER NOT NULL
+                    ) WITHOUT ROWID
                 """)
                 
-                # 创建索引以提高查询性能
+                await db.commit()
+
+                await self._migrate(db)
+
+                # 创建索引以提高查询性能（迁移可能重建了玩家表，放在迁移之后）
                 await db.execute("""
                     CREATE INDEX IF NOT EXISTS idx_players_username 
                     ON players(username)
@@ -70,145 +566,360 @@ class Database:
                     CREATE INDEX IF NOT EXISTS idx_players_exp 
                     ON players(exp DESC)
                 """)
-                
                 await db.commit()
-                logger.info("数据库初始化完成")
+
+                logger.info(f"数据库初始化完成 (PRAGMA配置档: {self.pragma_profile})")
                 
         except Exception as e:
             logger.error(f"数据库初始化失败: {e}")
             raise
     
+    async def _migrate(self, db: aiosqlite.Connection) -> None:
+        """
+        根据 PRAGMA user_version 执行尚未完成的数据迁移
+        """
+        async with db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+
+        if version < 1:
+            await self._migrate_items_to_tables(db)
+            await db.execute("PRAGMA user_version = 1")
+            await db.commit()
+            logger.info("数据库迁移完成: 背包已拆分到 player_materials / player_weapons")
+
+        if version < 2:
+            await self._migrate_times_to_epoch(db)
+            await db.execute("PRAGMA user_version = 2")
+            await db.commit()
+            logger.info("数据库迁移完成: 时间列已改为毫秒时间戳")
+
+        if version < 3:
+            await self._migrate_spirit_anchor(db)
+            await db.execute("PRAGMA user_version = 3")
+            await db.commit()
+            logger.info("数据库迁移完成: 灵力改为按锚点时间计算恢复")
+
+    async def _migrate_items_to_tables(self, db: aiosqlite.Connection) -> None:
+        """
+        把 players.items 中的 JSON 背包按批次迁移到背包表
+        每批在一个事务内写入背包行并清空原 JSON，中断后重新执行不会重复计数
+        """
+        last_user_id = None
+        migrated = 0
+
+        while True:
+            async with db.execute("""
+                SELECT user_id, items FROM players
+                WHERE items IS NOT NULL AND items NOT IN ('', '{}')
+                  AND (? IS NULL OR user_id > ?)
+                ORDER BY user_id
+                LIMIT ?
+            """, (last_user_id, last_user_id, MIGRATION_BATCH_SIZE)) as cursor:
+                rows = await cursor.fetchall()
+
+            if not rows:
+                break
+
+            material_rows = []
+            weapon_rows = []
+            migrated_ids = []
+            for row in rows:
+                try:
+                    items = json.loads(row['items'])
+                except json.JSONDecodeError:
+                    # 保留原始内容，方便人工修复
+                    logger.warning(f"玩家背包JSON损坏，跳过迁移 (user_id: {row['user_id']})")
+                    continue
+                materials, weapons = self._items_to_rows(row['user_id'], items)
+                material_rows.extend(materials)
+                weapon_rows.extend(weapons)
+                migrated_ids.append((row['user_id'],))
+
+            await db.executemany(UPSERT_MATERIAL_SQL, material_rows)
+            await db.executemany(UPSERT_WEAPON_SQL, weapon_rows)
+            await db.executemany(
+                "UPDATE players SET items = '{}' WHERE user_id = ?",
+                migrated_ids
+            )
+            await db.commit()
+
+            migrated += len(rows)
+            last_user_id = rows[-1]['user_id']
+            logger.info(f"背包迁移进度: {migrated} 名玩家")
+
+    async def _migrate_times_to_epoch(self, db: aiosqlite.Connection) -> None:
+        """
+        把 players 表的 ISO 字符串时间列改为整数毫秒时间戳列
+        重建玩家表并按批复制，整个过程在一个事务中，中断后回滚，下次启动重新执行
+        """
+        async with db.execute("PRAGMA table_info(players)") as cursor:
+            existing = {row['name'] for row in await cursor.fetchall()}
+        if 'created_at_ms' in existing:
+            # 新建的数据库已经是新表结构
+            return
+
+        copy_columns = [name for name in PLAYER_COPY_COLUMNS if name in existing]
+        time_columns = [(name, column) for name, column in TIME_FIELDS.items() if name in existing]
+        select_columns = ", ".join(copy_columns + [name for name, _ in time_columns])
+        insert_columns = [PLAYER_COPY_COLUMNS[name] for name in copy_columns] + [column for _, column in time_columns]
+        insert_sql = (
+            f"INSERT INTO players ({', '.join(insert_columns)}) "
+            f"VALUES ({', '.join('?' for _ in insert_columns)})"
+        )
+
+        await db.execute("BEGIN")
+        try:
+            await db.execute("ALTER TABLE players RENAME TO players_legacy")
+            await db.execute(CREATE_PLAYERS_SQL)
+
+            last_user_id = None
+            migrated = 0
+            while True:
+                async with db.execute(f"""
+                    SELECT {select_columns} FROM players_legacy
+                    WHERE ? IS NULL OR user_id > ?
+                    ORDER BY user_id
+                    LIMIT ?
+                """, (last_user_id, last_user_id, MIGRATION_BATCH_SIZE)) as cursor:
+                    rows = await cursor.fetchall()
+
+                if not rows:
+                    break
+
+                await db.executemany(insert_sql, [
+                    [row[name] for name in copy_columns]
+                    + [to_epoch_ms(row[name]) for name, _ in time_columns]
+                    for row in rows
+                ])
+                migrated += len(rows)
+                last_user_id = rows[-1]['user_id']
+                logger.info(f"时间列迁移进度: {migrated} 名玩家")
+
+            # 旧表上的索引随表一起删除，由 init_database 在新表上重建
+            await db.execute("DROP TABLE players_legacy")
+            await db.commit()
+
+        except Exception:
+            await db.rollback()
+            raise
+
+    async def _migrate_spirit_anchor(self, db: aiosqlite.Connection) -> None:
+        """
+        把 spiritual_power 列改名为 spiritual_power_base 并增加 spirit_anchor_ms 列
+        旧数据以 updated_at 作为恢复起点，与原来的恢复规则一致
+        """
+        async with db.execute("PRAGMA table_info(players)") as cursor:
+            existing = {row['name'] for row in await cursor.fetchall()}
+
+        if 'spiritual_power_base' not in existing:
+            await db.execute("ALTER TABLE players RENAME COLUMN spiritual_power TO spiritual_power_base")
+        if 'spirit_anchor_ms' not in existing:
+            await db.execute("ALTER TABLE players ADD COLUMN spirit_anchor_ms INTEGER")
+        await db.execute("UPDATE players SET spirit_anchor_ms = updated_at_ms WHERE spirit_anchor_ms IS NULL")
+        await db.commit()
+
+    @staticmethod
+    def _items_to_rows(user_id: int, items: Any) -> Tuple[List[tuple], List[tuple]]:
+        """把旧的 items JSON 转换为材料行和武器行"""
+        material_rows = []
+        weapon_rows = []
+        if not isinstance(items, dict):
+            return material_rows, weapon_rows
+
+        for key, value in items.items():
+            if key == 'weapons' and isinstance(value, dict):
+                for name, weapon in value.items():
+                    if isinstance(weapon, dict):
+                        weapon_rows.append(Database._weapon_row(user_id, name, weapon))
+            elif key == 'materials' and isinstance(value, dict):
+                for item, amount in value.items():
+                    if isinstance(amount, dict):
+                        # 嵌套分区，例如副本材料 materials["challenge"]
+                        for sub_item, sub_amount in amount.items():
+                            if isinstance(sub_amount, int):
+                                material_rows.append((user_id, item, sub_item, sub_amount))
+                    elif isinstance(amount, int):
+                        material_rows.append((user_id, MATERIALS_BAG, item, amount))
+            elif isinstance(value, int):
+                material_rows.append((user_id, ITEMS_BAG, key, value))
+
+        return material_rows, weapon_rows
+
+    @staticmethod
+    def _weapon_row(user_id: int, name: str, weapon: Any) -> tuple:
+        """把武器转换为 player_weapons 表的一行"""
+        data = weapon.to_dict() if hasattr(weapon, 'to_dict') else dict(weapon)
+        data['name'] = name
+        return (user_id,) + tuple(data.get(column) for column in WEAPON_COLUMNS)
+
+    async def _load_items(self, db: aiosqlite.Connection, user_id: int) -> Dict[str, Any]:
+        """从背包表组装 items 字典"""
+        items: Dict[str, Any] = {"灵石": 0, "weapons": {}, "materials": {}}
+
+        async with db.execute(
+            "SELECT bag, item_id, qty FROM player_materials WHERE user_id = ?",
+            (user_id,)
+        ) as cursor:
+            async for bag, item_id, qty in cursor:
+                if bag == ITEMS_BAG:
+                    items[item_id] = qty
+                elif bag == MATERIALS_BAG:
+                    items["materials"][item_id] = qty
+                else:
+                    items["materials"].setdefault(bag, {})[item_id] = qty
+
+        async with db.execute(
+            f"SELECT {', '.join(WEAPON_COLUMNS)} FROM player_weapons WHERE user_id = ?",
+            (user_id,)
+        ) as cursor:
+            async for row in cursor:
+                weapon = {key: value for key, value in dict(row).items() if value is not None}
+                items["weapons"][row['name']] = weapon
+
+        return items
+
     async def get_player(self, user_id: int) -> Optional[PlayerData]:
         """
         根据用户ID获取玩家数据
         """
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute(
-                    "SELECT * FROM players WHERE user_id = ?", 
-                    (user_id,)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    
-                if row:
-                    # 转换为字典
-                    data = dict(row)
-                    
-                    # 解析JSON字段
-                    if data['items']:
-                        try:
-                            data['items'] = json.loads(data['items'])
-                        except json.JSONDecodeError:
-                            data['items'] = {"灵石": 0, "weapons": {}, "materials": {}}
-                    else:
-                        data['items'] = {"灵石": 0, "weapons": {}, "materials": {}}
-                    
-                    return PlayerData.from_dict(data)
-                    
-                return None
+            async with self.pool.connection() as db:
+                return await self._select_player(db, user_id)
                 
         except Exception as e:
             logger.error(f"获取玩家数据失败 (user_id: {user_id}): {e}")
             return None
     
+    async def _select_player(self, db: aiosqlite.Connection, user_id: int) -> Optional[PlayerData]:
+        """在给定连接上读取玩家及其背包"""
+        async with db.execute(
+            "SELECT * FROM players WHERE user_id = ?",
+            (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if not row:
+            return None
+
+        data = dict(row)
+        data['items'] = await self._load_items(db, user_id)
+        return PlayerData.from_dict(data)
+
     async def create_player(self, user_id: int, username: str, screen_name: str) -> PlayerData:
         """
         创建新玩家
         """
         try:
-            now = datetime.now(timezone.utc).isoformat()
-            default_items = json.dumps({"灵石": 0, "weapons": {}, "materials": {}})
+            now = now_ms()
             
-            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-                await db.execute("""
-                    INSERT INTO players (
-                        user_id, username, screen_name, realm, exp, 
-                        spiritual_power, max_spiritual_power, max_hp, 
-                        attack, defense, items, created_at, updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    user_id, username, screen_name, "练气期", 0,
-                    100, 100, 100, 10, 5, default_items, now, now
-                ))
-                await db.commit()
+            async with self.pool.connection() as db:
+                if SUPPORTS_RETURNING:
+                    # 直接用 RETURNING 拿到新行，不再重新查询
+                    async with db.execute(
+                        INSERT_PLAYER_SQL + " RETURNING *",
+                        (user_id, username, screen_name, now, now, now)
+                    ) as cursor:
+                        row = await cursor.fetchone()
+                    await db.commit()
+                    player = PlayerData.from_dict({**dict(row), 'items': {}})
+                else:
+                    await db.execute(INSERT_PLAYER_SQL, (user_id, username, screen_name, now, now, now))
+                    await db.commit()
+                    player = await self._select_player(db, user_id)
                 
             logger.info(f"创建新玩家: {username} (ID: {user_id})")
-            
-            # 返回新创建的玩家数据
-            player = await self.get_player(user_id)
             return player
             
         except Exception as e:
             logger.error(f"创建玩家失败 (user_id: {user_id}): {e}")
             raise
-    
-    async def update_player(self, player: PlayerData) -> PlayerData:
+
+    async def get_or_create(self, user_id: int, username: str, screen_name: str) -> PlayerData:
         """
-        更新玩家数据
+        获取玩家，不存在时创建
+        在同一个连接上完成：已有玩家一次查询；新玩家用 INSERT ... ON CONFLICT DO NOTHING RETURNING *
+        直接得到新行，并发创建同一玩家时冲突的一方回退为查询
         """
         try:
-            now = datetime.now(timezone.utc).isoformat()
-            
-            # 将玩家数据转换为数据库格式
-            player_dict = player.to_dict()
-            items_json = json.dumps(player_dict['items'])
-            
-            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-                await db.execute("""
-                    UPDATE players SET
-                        username = ?,
-                        screen_name = ?,
-                        realm = ?,
-                        exp = ?,
-                        spiritual_power = ?,
-                        max_spiritual_power = ?,
-                        max_hp = ?,
-                        attack = ?,
-                        defense = ?,
-                        items = ?,
-                        equipped_weapon = ?,
-                        last_meditation_time = ?,
-                        last_herb_gathering_time = ?,
-                        last_mining_time = ?,
-                        last_challenge_time = ?,
-                        updated_at = ?
-                    WHERE user_id = ?
-                """, (
-                    player.username,
-                    player.screen_name,
-                    player.realm,
-                    player.exp,
-                    player.spiritual_power,
-                    player.max_spiritual_power,
-                    player.max_hp,
-                    player.attack,
-                    player.defense,
-                    items_json,
-                    player.equipped_weapon,
-                    player_dict.get('last_meditation_time'),
-                    player_dict.get('last_herb_gathering_time'),
-                    player_dict.get('last_mining_time'),
-                    player_dict.get('last_challenge_time'),
-                    now,
-                    player.user_id
-                ))
+            async with self.pool.connection() as db:
+                player = await self._select_player(db, user_id)
+                if player is not None:
+                    return player
+
+                now = now_ms()
+                params = (user_id, username, screen_name, now, now, now)
+                row = None
+                if SUPPORTS_RETURNING:
+                    async with db.execute(
+                        INSERT_PLAYER_SQL + " ON CONFLICT(user_id) DO NOTHING RETURNING *",
+                        params
+                    ) as cursor:
+                        row = await cursor.fetchone()
+                else:
+                    await db.execute(
+                        INSERT_PLAYER_SQL.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1),
+                        params
+                    )
                 await db.commit()
-                
-            logger.debug(f"更新玩家数据: {player.username} (ID: {player.user_id})")
+
+                if row is not None:
+                    logger.info(f"创建新玩家: {username} (ID: {user_id})")
+                    return PlayerData.from_dict({**dict(row), 'items': {}})
+
+                # 其他协程抢先创建了该玩家（或不支持 RETURNING），读取已有数据
+                return await self._select_player(db, user_id)
+
+        except Exception as e:
+            logger.error(f"获取/创建玩家失败 (user_id: {user_id}): {e}")
+            raise
+    
+    async def update_player(self, player: PlayerData, updated_at_ms: Optional[int] = None) -> PlayerData:
+        """
+        更新玩家数据，只写入自上次保存以来被修改过的列
+        写入交给 WriteCoalescer 与其他并发写入合并提交，事务提交后才返回
+        updated_at_ms 用于写回缓存保留实际修改时间，默认使用当前时间
+        """
+        dirty_fields = player.take_dirty_fields()
+        material_deltas, dirty_weapons, removed_weapons = player.take_inventory_changes()
+        try:
+            updated_at_ms = updated_at_ms or now_ms()
+            player.updated_at_ms = updated_at_ms
+
+            # 提交时就取出列值，等待期间的新修改留给下一次写入
+            write = PlayerWrite(
+                user_id=player.user_id,
+                updated_at_ms=updated_at_ms,
+                columns={
+                    name: getattr(player, name)
+                    for name in PLAYER_UPDATE_COLUMNS if name in dirty_fields
+                },
+                material_deltas=dict(material_deltas)
+            )
+            # 背包只写入变化的行：材料按增量累加，武器按名称覆盖或删除
+            for name in dirty_weapons:
+                weapon = player.items.get("weapons", {}).get(name)
+                write.weapons[name] = None if weapon is None else self._weapon_row(player.user_id, name, weapon)
+            for name in removed_weapons:
+                write.weapons[name] = None
+
+            await self.writer.submit(write)
+
+            logger.debug(f"更新玩家数据: {player.username} (ID: {player.user_id}), 字段: {list(write.columns)}")
             return player
             
         except Exception as e:
+            # 写入失败，恢复修改标记以便下次重试
+            player.mark_dirty(*dirty_fields)
+            player.restore_inventory_changes(material_deltas, dirty_weapons, removed_weapons)
             logger.error(f"更新玩家数据失败 (user_id: {player.user_id}): {e}")
             raise
-    
+
     async def get_leaderboard(self, limit: int = 10) -> List[Dict[str, Any]]:
         """
         获取排行榜数据
         """
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-                db.row_factory = aiosqlite.Row
+            async with self.pool.connection() as db:
                 async with db.execute("""
                     SELECT user_id, username, screen_name, realm, exp
                     FROM players
@@ -223,12 +934,109 @@ class Database:
             logger.error(f"获取排行榜失败: {e}")
             return []
     
+    async def get_leaderboard_entries(self) -> List[LeaderboardEntry]:
+        """
+        读取所有玩家的排行信息，用于启动时构建内存排行榜
+        """
+        try:
+            async with self.pool.connection() as db:
+                async with db.execute(
+                    "SELECT user_id, username, screen_name, realm, exp FROM players"
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            return [
+                LeaderboardEntry(row['user_id'], row['username'], row['screen_name'], row['realm'], row['exp'])
+                for row in rows
+            ]
+
+        except Exception as e:
+            logger.error(f"读取排行信息失败: {e}")
+            raise
+
+    async def get_action_times(self, since_ms: int) -> List[Dict[str, Any]]:
+        """
+        读取 since_ms 之后做过冷却动作的玩家及其动作时间，用于启动时重建冷却索引
+        """
+        try:
+            async with self.pool.connection() as db:
+                async with db.execute("""
+                    SELECT user_id, last_meditation_time_ms, last_herb_gathering_time_ms,
+                           last_mining_time_ms, last_challenge_time_ms
+                    FROM players
+                    WHERE last_meditation_time_ms >= ?1 OR last_herb_gathering_time_ms >= ?1
+                       OR last_mining_time_ms >= ?1 OR last_challenge_time_ms >= ?1
+                """, (since_ms,)) as cursor:
+                    rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
+
+        except Exception as e:
+            logger.error(f"读取动作时间失败: {e}")
+            return []
+
+    async def get_material_total(self, item_id: str) -> int:
+        """
+        统计全服某种材料的总量，例如流通中的灵石
+        """
+        try:
+            async with self.pool.connection() as db:
+                async with db.execute(
+                    "SELECT COALESCE(SUM(qty), 0) FROM player_materials WHERE item_id = ?",
+                    (item_id,)
+                ) as cursor:
+                    result = await cursor.fetchone()
+                    return result[0] if result else 0
+
+        except Exception as e:
+            logger.error(f"统计材料总量失败 (item_id: {item_id}): {e}")
+            return 0
+
+    async def get_media_files(self) -> Dict[str, Tuple[str, str]]:
+        """
+        读取已上传的媒体文件：路径 -> (内容哈希, file_id)
+        """
+        try:
+            async with self.pool.connection() as db:
+                async with db.execute("SELECT path, content_hash, file_id FROM media_files") as cursor:
+                    rows = await cursor.fetchall()
+            return {row['path']: (row['content_hash'], row['file_id']) for row in rows}
+
+        except Exception as e:
+            logger.error(f"读取媒体文件记录失败: {e}")
+            return {}
+
+    async def save_media_file(self, path: str, content_hash: str, file_id: str) -> None:
+        """
+        保存媒体文件上传后得到的 file_id，同一路径覆盖旧记录
+        """
+        try:
+            async with self.pool.connection() as db:
+                await db.execute(
+                    "INSERT OR REPLACE INTO media_files (path, content_hash, file_id, updated_at_ms) VALUES (?, ?, ?, ?)",
+                    (path, content_hash, file_id, now_ms())
+                )
+                await db.commit()
+
+        except Exception as e:
+            logger.error(f"保存媒体文件记录失败 (path: {path}): {e}")
+
+    async def delete_media_file(self, path: str) -> None:
+        """
+        删除失效的媒体文件记录
+        """
+        try:
+            async with self.pool.connection() as db:
+                await db.execute("DELETE FROM media_files WHERE path = ?", (path,))
+                await db.commit()
+
+        except Exception as e:
+            logger.error(f"删除媒体文件记录失败 (path: {path}): {e}")
+
     async def get_player_count(self) -> int:
         """
         获取玩家总数
         """
         try:
-            async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            async with self.pool.connection() as db:
                 async with db.execute("SELECT COUNT(*) FROM players") as cursor:
                     result = await cursor.fetchone()
                     return result[0] if result else 0
@@ -242,7 +1050,7 @@ class Database:
         备份数据库
         """
         try:
-            async with aiosqlite.connect(self.db_path) as source:
+            async with self.pool.connection() as source:
                 async with aiosqlite.connect(backup_path) as backup:
                     await source.backup(backup)
                     
@@ -255,34 +1063,98 @@ class Database:
     
     async def close(self):
         """
-        关闭数据库连接（SQLite不需要显式关闭，但保留接口兼容性）
+        关闭连接池中的所有数据库连接
         """
+        await self.writer.close()
+        await self.pool.close()
+        # 允许关闭后重新初始化（例如测试或重启事件循环）
+        self.pool = self._create_pool()
+        self.writer = WriteCoalescer(self.pool)
         logger.info("数据库连接已关闭")
 
 # 全局数据库实例
 database = Database()
 
+# 全局玩家缓存，便捷函数中的玩家读写都经过缓存
+player_cache = PlayerCache(database)
+
+# 全局内存排行榜，随便捷函数中的玩家创建和更新同步维护
+leaderboard = Leaderboard()
+
 # 便捷函数
 async def init_db():
-    """初始化数据库"""
+    """初始化数据库，加载排行榜并启动玩家缓存的定时刷盘"""
     await database.init_database()
+    leaderboard.load(await database.get_leaderboard_entries())
+    player_cache.start()
+
+async def close_db():
+    """把玩家缓存中的修改写回数据库，然后关闭数据库连接池"""
+    await player_cache.close()
+    await database.close()
 
 async def get_player(user_id: int) -> Optional[PlayerData]:
     """获取玩家数据"""
-    return await database.get_player(user_id)
+    return await player_cache.get(user_id)
 
 async def create_player(user_id: int, username: str, screen_name: str) -> PlayerData:
     """创建玩家"""
-    return await database.create_player(user_id, username, screen_name)
+    player = await player_cache.create(user_id, username, screen_name)
+    if player is not None:
+        leaderboard.update_player(player)
+    return player
+
+async def get_or_create_player(user_id: int, username: str, screen_name: str) -> PlayerData:
+    """获取玩家数据，不存在时创建"""
+    player = await player_cache.get_or_create(user_id, username, screen_name)
+    if player.user_id not in leaderboard:
+        leaderboard.update_player(player)
+    return player
 
 async def update_player(player: PlayerData) -> PlayerData:
     """更新玩家数据"""
-    return await database.update_player(player)
+    player = await player_cache.update(player)
+    leaderboard.update_player(player)
+    return player
+
+async def flush_players() -> int:
+    """立即把玩家缓存中的修改写回数据库"""
+    return await player_cache.flush()
 
 async def get_leaderboard(limit: int = 10) -> List[Dict[str, Any]]:
-    """获取排行榜"""
-    return await database.get_leaderboard(limit)
+    """获取排行榜（来自内存排行榜，不访问数据库）"""
+    return [entry.to_dict() for entry in leaderboard.top(limit)]
+
+def get_rank(user_id: int) -> Optional[int]:
+    """获取玩家的修为名次（从1开始），O(log n)"""
+    return leaderboard.get_rank(user_id)
+
+def get_players_around(user_id: int, k: int = 5) -> List[Dict[str, Any]]:
+    """获取玩家前后各 k 名的排行信息，每项带有 rank 字段"""
+    return [{'rank': rank, **entry.to_dict()} for rank, entry in leaderboard.around(user_id, k)]
+
+async def get_action_times(since_ms: int) -> List[Dict[str, Any]]:
+    """读取最近做过冷却动作的玩家（先刷盘，保证包含缓存中的修改）"""
+    await player_cache.flush()
+    return await database.get_action_times(since_ms)
+
+async def get_material_total(item_id: str) -> int:
+    """统计全服某种材料的总量（先刷盘，保证包含缓存中的修改）"""
+    await player_cache.flush()
+    return await database.get_material_total(item_id)
 
 async def get_player_count() -> int:
     """获取玩家总数"""
-    return await database.get_player_count()
\ No newline at end of file
+    return await database.get_player_count()
+
+async def get_media_files() -> Dict[str, Tuple[str, str]]:
+    """读取已上传的媒体文件：路径 -> (内容哈希, file_id)"""
+    return await database.get_media_files()
+
+async def save_media_file(path: str, content_hash: str, file_id: str) -> None:
+    """保存媒体文件的 file_id"""
+    await database.save_media_file(path, content_hash, file_id)
+
+async def delete_media_file(path: str) -> None:
+    """删除失效的媒体文件记录"""
+    await database.delete_media_file(path)
\ No newline at end of file
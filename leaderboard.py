@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人内存排行榜
+启动时从数据库加载全部玩家，之后随玩家更新增量维护，/paihang 不再访问数据库
+"""
+
+import logging
+import random
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 排序键：经验从高到低，经验相同时 user_id 小的在前
+RankKey = Tuple[int, int]
+
+
+@dataclass
+class LeaderboardEntry:
+    """排行榜中的一名玩家"""
+    user_id: int
+    username: str
+    screen_name: str
+    realm: str
+    exp: int
+
+    @property
+    def key(self) -> RankKey:
+        return (-self.exp, self.user_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为与数据库查询结果相同格式的字典"""
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'screen_name': self.screen_name,
+            'realm': self.realm,
+            'exp': self.exp,
+        }
+
+
+class _Node:
+    """跳表节点，width[i] 是第 i 层到下一个节点跨过的名次数"""
+    __slots__ = ('key', 'entry', 'forward', 'width')
+
+    def __init__(self, key: Optional[RankKey], entry: Optional[LeaderboardEntry], level: int):
+        self.key = key
+        self.entry = entry
+        self.forward: List[Optional["_Node"]] = [None] * level
+        self.width: List[int] = [0] * level
+
+
+class Leaderboard:
+    """
+    按 (经验, user_id) 排序的可索引跳表排行榜
+
+    - 插入、删除、修改经验 O(log n)，取前N名 O(N)
+    - 每一层链接记录跨过的名次数，查询名次、按名次取玩家 O(log n)
+    - 排名靠前部分渲染好的文本会被缓存，只有前N名发生变化时才重新渲染
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self, seed: Optional[int] = None):
+        self._random = random.Random(seed)
+        self._head = _Node(None, None, self.MAX_LEVEL)
+        self._level = 1
+        self._nodes: Dict[int, _Node] = {}
+        # limit -> (第limit名的排序键, 渲染好的文本)
+        self._rendered: Dict[int, Tuple[Optional[RankKey], str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._nodes
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and self._random.random() < self.P:
+            level += 1
+        return level
+
+    def load(self, entries: Iterable[LeaderboardEntry]) -> None:
+        """
+        用全部玩家重建排行榜：排序后按顺序链接，O(n log n)
+        """
+        self._head = _Node(None, None, self.MAX_LEVEL)
+        self._level = 1
+        self._nodes = {}
+        self._rendered.clear()
+
+        tails = [self._head] * self.MAX_LEVEL
+        tail_ranks = [0] * self.MAX_LEVEL
+        rank = 0
+        for entry in sorted(entries, key=lambda e: e.key):
+            if entry.user_id in self._nodes:
+                continue
+            rank += 1
+            level = self._random_level()
+            node = _Node(entry.key, entry, level)
+            for i in range(level):
+                tails[i].forward[i] = node
+                tails[i].width[i] = rank - tail_ranks[i]
+                tails[i] = node
+                tail_ranks[i] = rank
+            self._level = max(self._level, level)
+            self._nodes[entry.user_id] = node
+
+        logger.info(f"排行榜已加载: {len(self._nodes)} 名玩家")
+
+    def _find_update(self, key: RankKey) -> Tuple[List[_Node], List[int]]:
+        """找到每一层中排序键小于 key 的最后一个节点，以及这些节点的名次（表头为0）"""
+        update = [self._head] * self.MAX_LEVEL
+        ranks = [0] * self.MAX_LEVEL
+        node = self._head
+        rank = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key < key:
+                rank += node.width[i]
+                node = node.forward[i]
+            update[i] = node
+            ranks[i] = rank
+        return update, ranks
+
+    def _insert(self, entry: LeaderboardEntry) -> None:
+        key = entry.key
+        update, ranks = self._find_update(key)
+        level = self._random_level()
+        if level > self._level:
+            # 新增的层从表头直接指向新节点
+            self._level = level
+        node = _Node(key, entry, level)
+        for i in range(self._level):
+            if i < level:
+                node.forward[i] = update[i].forward[i]
+                node.width[i] = update[i].width[i] - (ranks[0] - ranks[i])
+                update[i].forward[i] = node
+                update[i].width[i] = ranks[0] - ranks[i] + 1
+            else:
+                update[i].width[i] += 1
+        self._nodes[entry.user_id] = node
+
+    def _remove(self, user_id: int) -> Optional[_Node]:
+        node = self._nodes.pop(user_id, None)
+        if node is None:
+            return None
+        update, _ = self._find_update(node.key)
+        for i in range(self._level):
+            if i < len(node.forward) and update[i].forward[i] is node:
+                update[i].width[i] += node.width[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.forward[self._level - 1] is None:
+            self._level -= 1
+        return node
+
+    def _invalidate(self, *keys: RankKey) -> None:
+        """丢弃受影响的渲染缓存：变化发生在缓存的前N名范围内时才需要重新渲染"""
+        for limit, (boundary, _) in list(self._rendered.items()):
+            if boundary is None or any(key <= boundary for key in keys):
+                del self._rendered[limit]
+
+    def update(self, user_id: int, username: str, screen_name: str, realm: str, exp: int) -> None:
+        """
+        新增或更新一名玩家；经验没有变化时只更新显示信息
+        """
+        node = self._nodes.get(user_id)
+        if node is not None and node.entry.exp == exp:
+            entry = node.entry
+            if (entry.username, entry.screen_name, entry.realm) != (username, screen_name, realm):
+                entry.username, entry.screen_name, entry.realm = username, screen_name, realm
+                self._invalidate(node.key)
+            return
+
+        old_key = None
+        if node is not None:
+            old_key = node.key
+            self._remove(user_id)
+        entry = LeaderboardEntry(user_id, username, screen_name, realm, exp)
+        self._insert(entry)
+        if old_key is not None:
+            self._invalidate(entry.key, old_key)
+        else:
+            self._invalidate(entry.key)
+
+    def update_player(self, player: Any) -> None:
+        """用 PlayerData 更新排行榜"""
+        self.update(player.user_id, player.username, player.screen_name, player.realm, player.exp)
+
+    def remove(self, user_id: int) -> None:
+        """移除一名玩家"""
+        node = self._remove(user_id)
+        if node is not None:
+            self._invalidate(node.key)
+
+    def top(self, limit: int = 10) -> List[LeaderboardEntry]:
+        """获取前 limit 名，O(limit)"""
+        result = []
+        node = self._head.forward[0]
+        while node is not None and len(result) < limit:
+            result.append(node.entry)
+            node = node.forward[0]
+        return result
+
+    def get_rank(self, user_id: int) -> Optional[int]:
+        """获取玩家名次（从1开始），不在榜上时返回 None，O(log n)"""
+        target = self._nodes.get(user_id)
+        if target is None:
+            return None
+
+        node = self._head
+        rank = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key <= target.key:
+                rank += node.width[i]
+                node = node.forward[i]
+        return rank
+
+    def _node_at(self, rank: int) -> Optional[_Node]:
+        """按名次（从1开始）找到节点，O(log n)"""
+        if rank < 1 or rank > len(self._nodes):
+            return None
+
+        node = self._head
+        passed = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.forward[i] is not None and passed + node.width[i] <= rank:
+                passed += node.width[i]
+                node = node.forward[i]
+        return node
+
+    def get_by_rank(self, rank: int) -> Optional[LeaderboardEntry]:
+        """获取第 rank 名的玩家"""
+        node = self._node_at(rank)
+        return node.entry if node is not None else None
+
+    def around(self, user_id: int, k: int = 5) -> List[Tuple[int, LeaderboardEntry]]:
+        """
+        获取玩家前后各 k 名（包括自己），返回 (名次, 玩家) 列表，O(log n + k)
+        """
+        rank = self.get_rank(user_id)
+        if rank is None:
+            return []
+
+        start = max(1, rank - k)
+        node = self._node_at(start)
+        result = []
+        while node is not None and start + len(result) <= rank + k:
+            result.append((start + len(result), node.entry))
+            node = node.forward[0]
+        return result
+
+    def render(self, limit: int, formatter: Callable[[List[LeaderboardEntry]], str]) -> str:
+        """
+        获取前 limit 名渲染后的文本，前N名没有变化时直接返回缓存
+        """
+        cached = self._rendered.get(limit)
+        if cached is not None:
+            return cached[1]
+
+        entries = self.top(limit)
+        text = formatter(entries)
+        # 不足 limit 名时任何新玩家都会进入榜单，用 None 表示任何变化都要重新渲染
+        boundary = entries[-1].key if len(entries) >= limit else None
+        self._rendered[limit] = (boundary, text)
+        return text
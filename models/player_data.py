@@ -1,7 +1,101 @@
-from datetime import datetime, timezone
-from typing import Optional, Dict, Any, List
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Set, Tuple, Mapping, Iterator
 from dataclasses import dataclass, field, asdict
 from .weapon_data import WeaponData
+from .realm_data import REALM_LEVELS
+
+# 需要追踪修改的字段，与 players 表的列一一对应（user_id、created_at_ms、updated_at_ms 由数据库层维护）
+# 背包不在其中：材料和武器通过下面的背包接口记录增量，保存到独立的表中
+TRACKED_FIELDS = frozenset({
+    'username',
+    'screen_name',
+    'realm',
+    'exp',
+    'spiritual_power_base',
+    'max_spiritual_power',
+    'max_hp',
+    'attack',
+    'defense',
+    'equipped_weapon',
+    'last_meditation_time_ms',
+    'last_herb_gathering_time_ms',
+    'last_mining_time_ms',
+    'last_challenge_time_ms',
+    'spirit_anchor_ms',
+})
+
+# 时间字段以 UTC 毫秒时间戳保存：属性名 -> 字段（数据库列）名
+# 读取玩家时不再解析 ISO 字符串，只有访问对应属性时才换算成 datetime
+TIME_FIELDS = {
+    'last_meditation_time': 'last_meditation_time_ms',
+    'last_herb_gathering_time': 'last_herb_gathering_time_ms',
+    'last_mining_time': 'last_mining_time_ms',
+    'last_challenge_time': 'last_challenge_time_ms',
+    'created_at': 'created_at_ms',
+    'updated_at': 'updated_at_ms',
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# 灵力自然恢复：每 5 秒恢复 1 点
+SPIRIT_REGEN_INTERVAL_MS = 5000
+
+
+def now_ms() -> int:
+    """当前时间的毫秒时间戳"""
+    return time.time_ns() // 1_000_000
+
+
+def to_epoch_ms(value: Any) -> Optional[int]:
+    """把 datetime、ISO 字符串或数字转换为毫秒时间戳，无法识别时返回 None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        if value.lstrip('-').isdigit():
+            return int(value)
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (value - EPOCH) // timedelta(milliseconds=1)
+    return None
+
+
+def from_epoch_ms(value: Optional[int]) -> Optional[datetime]:
+    """把毫秒时间戳转换为带时区的 UTC datetime"""
+    if value is None:
+        return None
+    return EPOCH + timedelta(milliseconds=value)
+
+
+def _time_property(field_name: str) -> property:
+    """以 datetime 读写毫秒时间戳字段"""
+    def getter(self) -> Optional[datetime]:
+        return from_epoch_ms(getattr(self, field_name))
+
+    def setter(self, value: Any) -> None:
+        setattr(self, field_name, to_epoch_ms(value))
+
+    return property(getter, setter)
+
+
+def _time_fields_from_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """从字典中取出时间字段，兼容旧的 ISO 字符串键名"""
+    return {
+        field_name: data.get(field_name, data.get(name))
+        for name, field_name in TIME_FIELDS.items()
+    }
+
+# 背包分区：items 顶层（如旧数据中的 items["灵石"]）、普通材料、以及 materials 下嵌套的分区（如副本材料）
+ITEMS_BAG = "items"
+MATERIALS_BAG = "materials"
+CHALLENGE_BAG = "challenge"
 
 @dataclass
 class PlayerData:
@@ -11,7 +105,7 @@ class PlayerData:
     screen_name: str
     realm: str = "练气期"
     exp: int = 0
-    spiritual_power: int = 100
+    spiritual_power_base: int = 100  # spirit_anchor_ms 时刻的灵力，当前灵力见 spiritual_power
     max_spiritual_power: int = 100
     max_hp: int = 100
     attack: int = 10
@@ -22,12 +116,21 @@ class PlayerData:
         "materials": {}
     })
     equipped_weapon: Optional[str] = None
-    last_meditation_time: Optional[datetime] = None
-    last_herb_gathering_time: Optional[datetime] = None
-    last_mining_time: Optional[datetime] = None
-    last_challenge_time: Optional[datetime] = None
-    created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
+    last_meditation_time_ms: Optional[int] = None
+    last_herb_gathering_time_ms: Optional[int] = None
+    last_mining_time_ms: Optional[int] = None
+    last_challenge_time_ms: Optional[int] = None
+    spirit_anchor_ms: Optional[int] = None  # 灵力恢复的起算时间
+    created_at_ms: Optional[int] = None
+    updated_at_ms: Optional[int] = None
+
+    # 以 datetime 访问的时间属性
+    last_meditation_time = _time_property('last_meditation_time_ms')
+    last_herb_gathering_time = _time_property('last_herb_gathering_time_ms')
+    last_mining_time = _time_property('last_mining_time_ms')
+    last_challenge_time = _time_property('last_challenge_time_ms')
+    created_at = _time_property('created_at_ms')
+    updated_at = _time_property('updated_at_ms')
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'PlayerData':
@@ -38,7 +141,8 @@ class PlayerData:
             'screen_name': data.get('screen_name'),
             'realm': data.get('realm', "练气期"),
             'exp': data.get('exp', 0),
-            'spiritual_power': data.get('spiritual_power', 100),
+            'spiritual_power_base': data.get('spiritual_power_base', data.get('spiritual_power', 100)),
+            'spirit_anchor_ms': data.get('spirit_anchor_ms'),
             'max_hp': data.get('max_hp', 100),
             'max_spiritual_power': data.get('max_spiritual_power', 100),
             'attack': data.get('attack', 10),
@@ -49,12 +153,7 @@ class PlayerData:
                 "materials": {}
             }),
             'equipped_weapon': data.get('equipped_weapon'),
-            'last_meditation_time': data.get('last_meditation_time'),
-            'last_herb_gathering_time': data.get('last_herb_gathering_time'),
-            'last_mining_time': data.get('last_mining_time'),
-            'last_challenge_time': data.get('last_challenge_time'),
-            'created_at': data.get('created_at'),
-            'updated_at': data.get('updated_at')
+            **_time_fields_from_dict(data)
         }
 
         # 处理武器数据
@@ -87,29 +186,196 @@ class PlayerData:
                 "materials": {}
             }
 
-        # 处理时间字段
-        time_fields = [
-            'last_meditation_time',
-            'last_herb_gathering_time',
-            'last_mining_time',
-            'last_challenge_time',
-            'created_at',
-            'updated_at'
-        ]
-        
-        for field_name in time_fields:
+        # 时间字段统一为毫秒时间戳（数据库中读出的已经是整数，不需要转换）
+        for field_name in TIME_FIELDS.values():
             value = getattr(self, field_name)
-            if isinstance(value, str):
-                try:
-                    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                    if dt.tzinfo is None:
-                        dt = dt.replace(tzinfo=timezone.utc)
-                    setattr(self, field_name, dt)
-                except (ValueError, TypeError):
-                    setattr(self, field_name, None)
-            elif isinstance(value, datetime) and value.tzinfo is None:
-                setattr(self, field_name, value.replace(tzinfo=timezone.utc))
+            if value is not None and type(value) is not int:
+                setattr(self, field_name, to_epoch_ms(value))
+
+        # 初始化完成后才开始追踪字段修改
+        object.__setattr__(self, '_dirty_fields', set())
+        object.__setattr__(self, '_material_deltas', {})
+        object.__setattr__(self, '_dirty_weapons', set())
+        object.__setattr__(self, '_removed_weapons', set())
+        # 材料总价值 [价格表, 总价值]，第一次查询时计算，之后随背包变化增量更新
+        object.__setattr__(self, '_net_worth', None)
+        # 渲染好的背包文本 (价格表, 文本)，背包变化时作废
+        object.__setattr__(self, '_inventory_render', None)
+        object.__setattr__(self, '_tracking', True)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """记录被修改过的字段，用于只更新变化的列"""
+        if name in TRACKED_FIELDS and self.__dict__.get('_tracking'):
+            if self.__dict__.get(name) != value:
+                self._dirty_fields.add(name)
+        object.__setattr__(self, name, value)
+        if name == 'realm':
+            # 境界序号随境界一起更新，比较境界时不需要再查表
+            object.__setattr__(self, 'realm_level', REALM_LEVELS.get(value, 0))
+        elif name == 'equipped_weapon':
+            # 背包中显示已装备的武器
+            object.__setattr__(self, '_inventory_render', None)
+
+    def spiritual_power_at(self, at_ms: int) -> int:
+        """
+        计算某一时刻的灵力：由锚点时刻的灵力加上之后的自然恢复，不超过上限
+        """
+        base = self.spiritual_power_base
+        if base >= self.max_spiritual_power:
+            return base
+        anchor = self.spirit_anchor_ms or self.updated_at_ms
+        if anchor is None:
+            return base
+        recovered = max(0, at_ms - anchor) // SPIRIT_REGEN_INTERVAL_MS
+        return min(self.max_spiritual_power, base + recovered)
 
+    @property
+    def spiritual_power(self) -> int:
+        """当前灵力，读取时按经过的时间计算自然恢复，不需要写数据库"""
+        return self.spiritual_power_at(now_ms())
+
+    @spiritual_power.setter
+    def spiritual_power(self, value: int) -> None:
+        """
+        设置当前灵力：把恢复结果固定到 spiritual_power_base 并移动锚点
+        未满时保留不足一次恢复的进度，满灵力时从现在开始重新计时
+        """
+        at_ms = now_ms()
+        current = self.spiritual_power_at(at_ms)
+        if value == current:
+            return
+
+        anchor = self.spirit_anchor_ms or self.updated_at_ms
+        if anchor is None or current >= self.max_spiritual_power:
+            anchor = at_ms
+        else:
+            anchor = at_ms - (at_ms - anchor) % SPIRIT_REGEN_INTERVAL_MS
+        self.spiritual_power_base = value
+        self.spirit_anchor_ms = anchor
+
+    @property
+    def dirty_fields(self) -> frozenset:
+        """自上次保存以来被修改过的字段"""
+        return frozenset(self._dirty_fields)
+
+    def mark_dirty(self, *field_names: str) -> None:
+        """手动标记字段已修改"""
+        for name in field_names:
+            if name not in TRACKED_FIELDS:
+                raise ValueError(f"未知的玩家字段: {name}")
+            self._dirty_fields.add(name)
+
+    def take_dirty_fields(self) -> frozenset:
+        """取出并清空已修改字段，保存失败时应通过 mark_dirty 放回"""
+        fields = frozenset(self._dirty_fields)
+        self._dirty_fields.clear()
+        return fields
+
+
+    def _bag(self, bag: str) -> Dict[str, Any]:
+        """获取背包分区对应的字典，不存在时创建"""
+        if bag == ITEMS_BAG:
+            return self.items
+        materials = self.items.setdefault("materials", {})
+        if bag == MATERIALS_BAG:
+            return materials
+        nested = materials.get(bag)
+        if not isinstance(nested, dict):
+            nested = materials[bag] = {}
+        return nested
+
+    def get_material(self, item: str, bag: str = MATERIALS_BAG) -> int:
+        """获取材料数量"""
+        return self._bag(bag).get(item, 0)
+
+    def add_material(self, item: str, amount: int, bag: str = MATERIALS_BAG) -> int:
+        """
+        增减材料数量（amount 可以为负），并记录增量以便只更新变化的行
+        返回新的数量
+        """
+        container = self._bag(bag)
+        quantity = container.get(item, 0) + amount
+        container[item] = quantity
+        key = (bag, item)
+        self._material_deltas[key] = self._material_deltas.get(key, 0) + amount
+        if bag != ITEMS_BAG and self._net_worth is not None:
+            self._net_worth[1] += self._net_worth[0].get(item, 0) * amount
+        self._inventory_render = None
+        return quantity
+
+    def iter_materials(self) -> Iterator[Tuple[str, str, int]]:
+        """遍历 materials 中的全部材料，包括嵌套分区（如副本材料）：(分区, 物品, 数量)"""
+        for item, amount in self.items.get("materials", {}).items():
+            if isinstance(amount, dict):
+                for sub_item, sub_amount in amount.items():
+                    yield item, sub_item, sub_amount
+            else:
+                yield MATERIALS_BAG, item, amount
+
+    def net_worth(self, prices: Mapping[str, int]) -> int:
+        """
+        materials 中全部材料按 prices 折合的灵石
+        第一次查询时遍历背包，之后由 add_material 增量维护；prices 换成另一份价格表
+        （如重新加载游戏内容）时重新计算
+        """
+        cached = self._net_worth
+        if cached is None or cached[0] is not prices:
+            total = sum(prices.get(item, 0) * amount for _, item, amount in self.iter_materials())
+            cached = self._net_worth = [prices, total]
+        return cached[1]
+
+    def get_inventory_render(self, prices: Mapping[str, int]) -> Optional[str]:
+        """缓存的背包文本，背包变化或价格表不同时返回 None"""
+        cached = self._inventory_render
+        if cached is None or cached[0] is not prices:
+            return None
+        return cached[1]
+
+    def set_inventory_render(self, prices: Mapping[str, int], text: str) -> None:
+        """缓存按 prices 渲染的背包文本"""
+        self._inventory_render = (prices, text)
+
+    def mark_weapon_dirty(self, weapon_name: str) -> None:
+        """标记武器属性已修改（如强化后）"""
+        self._dirty_weapons.add(weapon_name)
+        self._removed_weapons.discard(weapon_name)
+        self._inventory_render = None
+
+    def take_inventory_changes(self) -> Tuple[Dict[Tuple[str, str], int], Set[str], Set[str]]:
+        """
+        取出并清空背包变化：(材料增量, 修改过的武器, 移除的武器)
+        保存失败时应通过 restore_inventory_changes 放回
+        """
+        changes = (
+            dict(self._material_deltas),
+            set(self._dirty_weapons),
+            set(self._removed_weapons)
+        )
+        self._material_deltas.clear()
+        self._dirty_weapons.clear()
+        self._removed_weapons.clear()
+        return changes
+
+    def restore_inventory_changes(
+        self,
+        material_deltas: Dict[Tuple[str, str], int],
+        dirty_weapons: Set[str],
+        removed_weapons: Set[str]
+    ) -> None:
+        """把保存失败的背包变化合并回待保存列表"""
+        for key, amount in material_deltas.items():
+            self._material_deltas[key] = self._material_deltas.get(key, 0) + amount
+        for name in dirty_weapons:
+            if name not in self._removed_weapons:
+                self._dirty_weapons.add(name)
+        for name in removed_weapons:
+            if name not in self._dirty_weapons:
+                self._removed_weapons.add(name)
+
+    @property
+    def has_inventory_changes(self) -> bool:
+        """背包是否有未保存的变化"""
+        return bool(self._material_deltas or self._dirty_weapons or self._removed_weapons)
 
     @property
     def total_attack(self) -> int:
@@ -126,12 +392,16 @@ class PlayerData:
         if "weapons" not in self.items:
             self.items["weapons"] = {}
         self.items["weapons"][weapon.name] = weapon
+        self.mark_weapon_dirty(weapon.name)
 
 
     def remove_weapon(self, weapon_name: str) -> Optional[WeaponData]:
         """从背包中移除武器"""
         if weapon_name in self.items["weapons"]:
             weapon = self.items["weapons"].pop(weapon_name)
+            self._dirty_weapons.discard(weapon_name)
+            self._removed_weapons.add(weapon_name)
+            self._inventory_render = None
             if self.equipped_weapon == weapon_name:
                 self.equipped_weapon = None
             return weapon
@@ -178,14 +448,14 @@ class PlayerData:
     def spend_spirit_stones(self, amount: int) -> bool:
         """消费灵石"""
         if self.has_enough_spirit_stones(amount):
-            self.items["灵石"] = self.items.get("灵石", 0) - amount
+            self.add_material("灵石", -amount, bag=ITEMS_BAG)
             return True
         return False
 
 
     def add_spirit_stones(self, amount: int) -> None:
         """添加灵石"""
-        self.items["灵石"] = self.items.get("灵石", 0) + amount
+        self.add_material("灵石", amount, bag=ITEMS_BAG)
 
 
     def to_dict(self) -> Dict[str, Any]:
@@ -196,7 +466,8 @@ class PlayerData:
             'screen_name': self.screen_name,
             'realm': self.realm,
             'exp': self.exp,
-            'spiritual_power': self.spiritual_power,
+            'spiritual_power_base': self.spiritual_power_base,
+            'spirit_anchor_ms': self.spirit_anchor_ms,
             'max_hp': self.max_hp,
             'max_spiritual_power': self.max_spiritual_power,
             'attack': self.attack,
@@ -204,27 +475,17 @@ class PlayerData:
             'equipped_weapon': self.equipped_weapon,
         }
 
-        # 处理时间字段
-        time_fields = [
-            'last_meditation_time',
-            'last_herb_gathering_time',
-            'last_mining_time',
-            'last_challenge_time',
-            'created_at',
-            'updated_at'
-        ]
-        
-        for field in time_fields:
-            value = getattr(self, field)
-            if isinstance(value, datetime):
-                if value.tzinfo is None:
-                    value = value.replace(tzinfo=timezone.utc)
-                data[field] = value.isoformat()
-            else:
-                data[field] = value
+        # 时间字段以毫秒时间戳输出
+        for field_name in TIME_FIELDS.values():
+            data[field_name] = getattr(self, field_name)
+
+        data['items'] = self.items_to_dict()
 
-        # 处理 items JSONB 字段
-        data['items'] = {
+        return data
+
+    def items_to_dict(self) -> Dict[str, Any]:
+        """把 items 转换为可以 JSON 序列化的字典"""
+        items = {
             "灵石": self.items.get("灵石", 0),
             "materials": self.items.get("materials", {}),
             "weapons": {}
@@ -235,14 +496,14 @@ class PlayerData:
         for name, weapon in weapons.items():
             if hasattr(weapon, 'to_dict'):
                 # 如果是 WeaponData 对象
-                data['items']["weapons"][name] = weapon.to_dict()
+                items["weapons"][name] = weapon.to_dict()
             elif isinstance(weapon, dict):
                 # 如果已经是字典格式
-                data['items']["weapons"][name] = weapon
+                items["weapons"][name] = weapon
             else:
                 # 其他情况，尝试转换为字典
                 try:
-                    data['items']["weapons"][name] = {
+                    items["weapons"][name] = {
                         'name': getattr(weapon, 'name', name),
                         'type': getattr(weapon, 'type', '武器'),
                         'attack': getattr(weapon, 'attack', 0),
@@ -253,7 +514,7 @@ class PlayerData:
                     }
                 except Exception as e:
                     # 使用默认值
-                    data['items']["weapons"][name] = {
+                    items["weapons"][name] = {
                         'name': name,
                         'type': '武器',
                         'attack': 0,
@@ -261,7 +522,7 @@ class PlayerData:
                         'description': ''
                     }
 
-        return data
+        return items
 
 
     @classmethod
@@ -275,18 +536,14 @@ class PlayerData:
             'screen_name': data.get('screen_name'),
             'realm': data.get('realm', "练气期"),
             'exp': data.get('exp', 0),
-            'spiritual_power': data.get('spiritual_power', 100),
+            'spiritual_power_base': data.get('spiritual_power_base', data.get('spiritual_power', 100)),
+            'spirit_anchor_ms': data.get('spirit_anchor_ms'),
             'max_spiritual_power': data.get('max_spiritual_power', 100),
             'max_hp': data.get('max_hp', 100),
             'attack': data.get('attack', 10),
             'defense': data.get('defense', 5),
             'equipped_weapon': data.get('equipped_weapon'),
-            'last_meditation_time': data.get('last_meditation_time'),
-            'last_herb_gathering_time': data.get('last_herb_gathering_time'),
-            'last_mining_time': data.get('last_mining_time'),
-            'last_challenge_time': data.get('last_challenge_time'),
-            'created_at': data.get('created_at'),
-            'updated_at': data.get('updated_at'),
+            **_time_fields_from_dict(data)
         }
 
         # 初始化默认的 items 结构
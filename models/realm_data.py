@@ -0,0 +1,56 @@
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+# 境界从低到高排列，玩家的境界序号（realm_level）即在此表中的下标
+REALMS: Tuple[str, ...] = (
+    "练气期", "筑基期", "金丹期", "元婴期", "化神期",
+    "炼虚期", "合体期", "大乘期", "渡劫期"
+)
+
+# 到达各境界所需的累计经验，与 REALMS 一一对应且单调递增
+REALM_EXP: Tuple[int, ...] = (
+    0, 1000, 5000, 20000, 50000,
+    100000, 200000, 500000, 1000000
+)
+
+REALM_LEVELS: Dict[str, int] = {realm: level for level, realm in enumerate(REALMS)}
+
+# 每突破一个境界增加的灵力上限
+BREAKTHROUGH_SPIRIT_BONUS = 50
+
+
+def realm_level(realm: str) -> int:
+    """境界序号，未知境界返回 -1"""
+    return REALM_LEVELS.get(realm, -1)
+
+
+def level_for_exp(exp: int) -> int:
+    """经验对应的境界序号：二分查找累计经验阈值"""
+    return max(0, bisect_right(REALM_EXP, exp) - 1)
+
+
+def next_realm(level: int) -> Optional[str]:
+    """下一境界名称，已是最高境界时返回 None"""
+    return REALMS[level + 1] if 0 <= level < len(REALMS) - 1 else None
+
+
+def exp_to_next(level: int, exp: int) -> Optional[int]:
+    """距离下一境界还需的经验，已是最高境界时返回 None"""
+    if not 0 <= level < len(REALMS) - 1:
+        return None
+    return REALM_EXP[level + 1] - exp
+
+
+def index_by_realm(requirements: Dict[str, str]) -> List[List[str]]:
+    """
+    预先计算每个境界可用的条目：requirements 为 条目名称 -> 要求境界，
+    result[level] 是要求境界不高于该境界的条目名称，保持原有顺序
+    """
+    available: List[List[str]] = [[] for _ in REALMS]
+    for name, required_realm in requirements.items():
+        required = realm_level(required_realm)
+        if required < 0:
+            continue
+        for level in range(required, len(REALMS)):
+            available[level].append(name)
+    return available
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+修仙Telegram机器人玩家缓存
+在数据库前面加一层进程内写回缓存：热点玩家的读取不访问磁盘，写入合并后批量落盘
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable, Set
+
+from models.player_data import PlayerData, now_ms
+from config import (
+    PLAYER_CACHE_MAX_SIZE, PLAYER_CACHE_FLUSH_INTERVAL, PLAYER_CACHE_FLUSH_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerCache:
+    """
+    带LRU淘汰和脏数据追踪的玩家写回缓存
+
+    - get/create 命中缓存时直接返回内存中的 PlayerData
+    - update 只标记脏数据，由定时任务或脏数据数量达到阈值时统一刷盘
+    - 只淘汰已经落盘的玩家，脏数据在刷盘前不会丢失
+    """
+
+    def __init__(
+        self,
+        db: Any,
+        max_size: int = PLAYER_CACHE_MAX_SIZE,
+        flush_interval: float = PLAYER_CACHE_FLUSH_INTERVAL,
+        flush_threshold: int = PLAYER_CACHE_FLUSH_THRESHOLD
+    ):
+        self.db = db
+        self.max_size = max(1, max_size)
+        self.flush_interval = flush_interval
+        self.flush_threshold = max(1, flush_threshold)
+        self._entries: "OrderedDict[int, PlayerData]" = OrderedDict()
+        self._dirty: "OrderedDict[int, None]" = OrderedDict()
+        self._in_flight: Set[int] = set()     # 正在刷盘的玩家，写入完成前同样不能淘汰
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._pending_flush: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def dirty_count(self) -> int:
+        """待刷盘的玩家数量"""
+        return len(self._dirty)
+
+    def _put(self, player: PlayerData) -> None:
+        """放入缓存并按LRU顺序淘汰干净的条目"""
+        self._entries[player.user_id] = player
+        self._entries.move_to_end(player.user_id)
+        self._evict()
+
+    def _evict(self) -> None:
+        """淘汰最久未使用的已落盘玩家；全部是脏数据或正在刷盘时触发一次刷盘"""
+        if len(self._entries) <= self.max_size:
+            return
+
+        for user_id in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                return
+            if user_id not in self._dirty and user_id not in self._in_flight:
+                del self._entries[user_id]
+
+        # 剩下的都是脏数据或正在刷盘，刷盘后再淘汰
+        if len(self._entries) > self.max_size:
+            self._schedule_flush()
+
+    async def get(self, user_id: int) -> Optional[PlayerData]:
+        """
+        获取玩家数据，未命中时从数据库加载；同一玩家的并发加载只访问一次数据库
+        """
+        return await self._load(user_id, lambda: self.db.get_player(user_id))
+
+    async def get_or_create(self, user_id: int, username: str, screen_name: str) -> PlayerData:
+        """获取玩家数据，数据库中也不存在时创建"""
+        return await self._load(
+            user_id, lambda: self.db.get_or_create(user_id, username, screen_name)
+        )
+
+    async def _load(
+        self,
+        user_id: int,
+        loader: Callable[[], Awaitable[Optional[PlayerData]]]
+    ) -> Optional[PlayerData]:
+        """命中缓存直接返回，否则调用 loader 加载并放入缓存"""
+        player = self._entries.get(user_id)
+        if player is not None:
+            self.hits += 1
+            self._entries.move_to_end(user_id)
+            return player
+
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            player = await asyncio.shield(loading)
+            if player is not None:
+                return player
+            # 正在进行的是 get 且玩家不存在，由本次调用自己加载（可能需要创建）
+            return await self._load(user_id, loader)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            player = await loader()
+            # 加载期间可能已经有人创建并放入了缓存
+            cached = self._entries.get(user_id)
+            if cached is not None:
+                player = cached
+            elif player is not None:
+                self._put(player)
+            future.set_result(player)
+            return player
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(user_id, None)
+
+    async def create(self, user_id: int, username: str, screen_name: str) -> PlayerData:
+        """创建新玩家并放入缓存"""
+        player = await self.db.create_player(user_id, username, screen_name)
+        if player is not None:
+            self._put(player)
+        return player
+
+    async def update(self, player: PlayerData) -> PlayerData:
+        """
+        更新玩家数据：只写内存并标记为脏，稍后批量落盘
+        """
+        player.updated_at_ms = now_ms()
+        self._put(player)
+        self._dirty[player.user_id] = None
+
+        if len(self._dirty) >= self.flush_threshold:
+            self._schedule_flush()
+        return player
+
+    def _schedule_flush(self) -> None:
+        """在后台安排一次刷盘，已经安排过的不重复安排"""
+        if self._pending_flush is not None and not self._pending_flush.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._pending_flush = loop.create_task(self.flush())
+
+    async def flush(self) -> int:
+        """
+        将所有脏数据写入数据库，返回写入的玩家数量
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            user_ids = list(self._dirty)
+            self._dirty.clear()
+            players = [self._entries[user_id] for user_id in user_ids if user_id in self._entries]
+            # 写入期间这些玩家不在 _dirty 中，由 _in_flight 防止被淘汰（否则会从数据库读到旧数据）
+            self._in_flight.update(player.user_id for player in players)
+            written = 0
+
+            try:
+                # 并发提交，由数据库的写入合并器合并成少量事务
+                results = await asyncio.gather(
+                    *(self.db.update_player(player, updated_at_ms=player.updated_at_ms) for player in players),
+                    return_exceptions=True
+                )
+                for player, result in zip(players, results):
+                    if isinstance(result, BaseException):
+                        logger.error(f"玩家缓存刷盘失败 (user_id: {player.user_id}): {result}")
+                        # 写入失败的玩家放回缓存并重新标记，等待下次刷盘（期间被 invalidate 的除外）
+                        if player.user_id in self._in_flight:
+                            self._entries.setdefault(player.user_id, player)
+                            self._dirty[player.user_id] = None
+                    else:
+                        written += 1
+            finally:
+                self._in_flight.difference_update(player.user_id for player in players)
+
+            self._evict()
+            logger.debug(f"玩家缓存刷盘完成: {written}/{len(user_ids)}")
+            return written
+
+    async def _flush_loop(self) -> None:
+        """定时刷盘任务"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"玩家缓存定时刷盘失败: {e}")
+
+    def start(self) -> None:
+        """启动定时刷盘任务，需要在事件循环中调用"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """
+        停止定时刷盘并把剩余脏数据全部写入数据库（关闭前的刷盘钩子）
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+        if self._pending_flush is not None and not self._pending_flush.done():
+            await self._pending_flush
+
+        await self.flush()
+        if self._dirty:
+            logger.error(f"关闭时仍有 {len(self._dirty)} 名玩家的数据未能写入数据库")
+        logger.info("玩家缓存已刷盘")
+
+    def invalidate(self, user_id: int) -> None:
+        """丢弃某个玩家的缓存（不会写入未落盘的修改）"""
+        self._entries.pop(user_id, None)
+        self._dirty.pop(user_id, None)
+        self._in_flight.discard(user_id)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数值平衡蒙特卡洛模拟
+直接读取游戏内容（data/content.json）中的秘境、矿洞、采药配置和武器商店，按境界和武器配置
+向量化模拟大量次副本战斗、副本奖励、采矿和采药，输出胜率、每小时期望经验/灵石及其标准差，
+用于上线前检查数值调整的效果
+
+需要 numpy（不是机器人运行的依赖，只在运行本工具时需要）：
+    pip install numpy
+
+使用方法：
+    python -m tools.simulate_balance
+    python -m tools.simulate_balance --trials 2000000 --realm 化神期 --all-weapons
+"""
+
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("本工具需要 numpy，请先执行: pip install numpy")
+
+from bot.combat import Combatant
+from bot.content import GameContent, load_content
+from bot.rewards import AliasTable, LootTable
+from config import COOLDOWN_TIMES, GAME_CONTENT_PATH
+from models.player_data import PlayerData, SPIRIT_REGEN_INTERVAL_MS
+from models.realm_data import REALMS, REALM_LEVELS
+
+# 每小时自然恢复的灵力
+SPIRIT_REGEN_PER_HOUR = 3600 * 1000 // SPIRIT_REGEN_INTERVAL_MS
+
+# 采药数量和额外经验范围（与 XianXiaGame.gather_herbs 一致）
+HERB_AMOUNT = (2, 5)
+HERB_EXP = (5, 15)
+
+
+@dataclass
+class Loadout:
+    """一套参战配置：境界 + 武器"""
+    realm: str
+    weapon: Optional[str]
+    attack: int
+    defense: int
+    max_hp: int
+
+
+@dataclass
+class ActivityStats:
+    """一项活动的模拟结果"""
+    name: str
+    runs_per_hour: float
+    win_rate: float
+    exp_mean: float
+    exp_var: float
+    stones_mean: float
+    stones_var: float
+    value_mean: float
+
+    def per_hour(self, mean: float, var: float) -> Tuple[float, float]:
+        """每小时的期望和标准差（每次独立）"""
+        return mean * self.runs_per_hour, float(np.sqrt(var * self.runs_per_hour))
+
+
+def runs_per_hour(cooldown_seconds: float, spirit_cost: float) -> float:
+    """每小时最多可以进行的次数：受冷却时间和灵力恢复速度共同限制"""
+    limits = [3600 / cooldown_seconds] if cooldown_seconds else []
+    if spirit_cost:
+        limits.append(SPIRIT_REGEN_PER_HOUR / spirit_cost)
+    return min(limits) if limits else float("inf")
+
+
+def uniform_int(rng: "np.random.Generator", bounds: Tuple[int, int], size: int) -> "np.ndarray":
+    """与 random.randint 相同的闭区间均匀整数"""
+    low, high = bounds
+    return rng.integers(low, high + 1, size=size)
+
+
+def simulate_battle(rng: "np.random.Generator", loadout: Loadout, enemies: Tuple[Combatant, ...], trials: int) -> "np.ndarray":
+    """
+    模拟 trials 次战斗，返回每次是否获胜
+
+    与 bot.combat.resolve_exchange 相同的规则：我方先手，击倒敌人需要 ceil(hp / 伤害) 次出手，
+    敌人最多出手其减一次；Boss 的每次出手等概率选择技能，只需要抽样各技能的使用次数。
+    """
+    hp = np.full(trials, loadout.max_hp, dtype=np.int64)
+    for enemy in enemies:
+        damage = max(1, loadout.attack - enemy.defense)
+        enemy_hits = max(0, -(-enemy.hp // damage) - 1)
+        if enemy.skills:
+            skill_damages = np.array([max(1, skill.damage - loadout.defense) for skill in enemy.skills])
+            counts = rng.multinomial(enemy_hits, np.full(len(skill_damages), 1 / len(skill_damages)), size=trials)
+            taken = counts @ skill_damages
+        else:
+            taken = enemy_hits * max(1, enemy.attack - loadout.defense)
+        # 累计伤害单调增加：敌人全部出手的伤害不足以击倒我方时才能获胜
+        hp = hp - taken
+    return hp > 0
+
+
+def sample_alias(rng: "np.random.Generator", table: AliasTable, size: int) -> "np.ndarray":
+    """向量化的 AliasTable.sample，使用游戏中同一张别名表"""
+    outcomes = np.array(table.outcomes)
+    u = rng.random(size) * len(table.prob)
+    index = u.astype(np.int64)
+    keep = (u - index) < np.array(table.prob)[index]
+    return np.where(keep, outcomes[index], outcomes[np.array(table.alias)[index]])
+
+
+def roll_loot(rng: "np.random.Generator", loot: LootTable, trials: int) -> Dict[str, "np.ndarray"]:
+    """向量化的 LootTable.roll"""
+    rewards = {"exp": uniform_int(rng, loot.exp, trials)}
+    for drop in loot.drops:
+        rewards[drop.name] = sample_alias(rng, drop.amounts, trials)
+    return rewards
+
+
+def item_value(content: GameContent, items: Dict[str, "np.ndarray"], trials: int) -> "np.ndarray":
+    """物品按出售价格折合的灵石"""
+    value = np.zeros(trials, dtype=np.int64)
+    for item, amounts in items.items():
+        value += amounts * content.herb_values.get(item, 0)
+    return value
+
+
+def summarize(
+    name: str,
+    rate: float,
+    exp: "np.ndarray",
+    stones: "np.ndarray",
+    value: "np.ndarray",
+    wins: Optional["np.ndarray"] = None
+) -> ActivityStats:
+    return ActivityStats(
+        name=name,
+        runs_per_hour=rate,
+        win_rate=float(wins.mean()) if wins is not None else 1.0,
+        exp_mean=float(exp.mean()),
+        exp_var=float(exp.var()),
+        stones_mean=float(stones.mean()),
+        stones_var=float(stones.var()),
+        value_mean=float(value.mean()),
+    )
+
+
+def simulate_stage(content: GameContent, rng: "np.random.Generator", loadout: Loadout, stage_name: str, trials: int) -> ActivityStats:
+    """模拟一个秘境副本：只有获胜才有奖励，失败同样消耗灵力和冷却"""
+    stage = content.stages[stage_name]
+    wins = simulate_battle(rng, loadout, stage.enemies, trials)
+
+    rewards = roll_loot(rng, stage.rewards.loot, trials)
+    rewards = {item: np.where(wins, amounts, 0) for item, amounts in rewards.items()}
+    exp = rewards.pop("exp")
+    stones = rewards.get("灵石", np.zeros(trials, dtype=np.int64))
+    value = item_value(content, rewards, trials)
+
+    rate = runs_per_hour(COOLDOWN_TIMES["challenge"], stage.spirit_cost)
+    return summarize(f"秘境·{stage_name}", rate, exp, stones, value, wins)
+
+
+def simulate_mining(content: GameContent, rng: "np.random.Generator", realm: str, trials: int) -> Optional[ActivityStats]:
+    """模拟采矿：随机选择一个可用矿区，按矿区的掉落表获得物品"""
+    names = content.mining_locations_by_level[REALM_LEVELS[realm]]
+    if not names:
+        return None
+
+    chosen = rng.integers(0, len(names), size=trials)
+    exp = np.zeros(trials, dtype=np.int64)
+    items: Dict[str, "np.ndarray"] = {}
+    for index, name in enumerate(names):
+        mask = chosen == index
+        rewards = roll_loot(rng, content.mining_locations[name].loot, int(mask.sum()))
+        exp[mask] = rewards.pop("exp")
+        for item, amounts in rewards.items():
+            items.setdefault(item, np.zeros(trials, dtype=np.int64))[mask] += amounts
+
+    stones = items.pop("灵石", np.zeros(trials, dtype=np.int64))
+    value = item_value(content, items, trials)
+    mean_cost = np.mean([content.mining_locations[name].spirit_cost for name in names])
+    return summarize("采矿", runs_per_hour(COOLDOWN_TIMES["mining"], mean_cost), exp, stones, value)
+
+
+def simulate_herbs(content: GameContent, rng: "np.random.Generator", realm: str, trials: int) -> Optional[ActivityStats]:
+    """模拟采药：随机选择一个可用药园和其中一种药材"""
+    names = content.herb_locations_by_level[REALM_LEVELS[realm]]
+    if not names:
+        return None
+
+    chosen = rng.integers(0, len(names), size=trials)
+    unit_value = np.zeros(trials, dtype=np.int64)
+    for index, name in enumerate(names):
+        herbs = content.herb_locations[name].herbs
+        mask = chosen == index
+        prices = np.array([content.herb_values.get(herb, 0) for herb in herbs])
+        unit_value[mask] = prices[rng.integers(0, len(herbs), size=int(mask.sum()))]
+
+    value = unit_value * uniform_int(rng, HERB_AMOUNT, trials)
+    exp = uniform_int(rng, HERB_EXP, trials)
+    stones = np.zeros(trials, dtype=np.int64)
+    mean_cost = np.mean([content.herb_locations[name].spiritual_power_cost for name in names])
+    return summarize("采药", runs_per_hour(COOLDOWN_TIMES["herb_gathering"], mean_cost), exp, stones, value)
+
+
+def loadouts_for(content: GameContent, realm: str, all_weapons: bool) -> List[Loadout]:
+    """某个境界的参战配置：不装备武器、装备可购买的最强武器（或全部可购买武器）"""
+    base = PlayerData(user_id=0, username="", screen_name="")
+    weapons = [(name, content.weapons[name].attack) for name in content.weapons_by_level[REALM_LEVELS[realm]]]
+    if weapons and not all_weapons:
+        weapons = [max(weapons, key=lambda weapon: weapon[1])]
+
+    loadouts = [Loadout(realm, None, base.attack, base.defense, base.max_hp)]
+    for name, attack in weapons:
+        loadouts.append(Loadout(realm, name, base.attack + attack, base.defense, base.max_hp))
+    return loadouts
+
+
+def print_row(label: str, stats: ActivityStats) -> None:
+    exp_hour, exp_std = stats.per_hour(stats.exp_mean, stats.exp_var)
+    stones_hour, stones_std = stats.per_hour(stats.stones_mean, stats.stones_var)
+    print(
+        f"  {label:<22}{stats.win_rate:>8.1%}{stats.runs_per_hour:>8.1f}"
+        f"{exp_hour:>12.0f}{exp_std:>10.0f}{stones_hour:>12.0f}{stones_std:>10.0f}"
+        f"{stats.value_mean * stats.runs_per_hour:>12.0f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="秘境、采矿、采药数值平衡的蒙特卡洛模拟")
+    parser.add_argument("--trials", type=int, default=1_000_000, help="每项模拟的次数")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--realm", action="append", help="只模拟指定境界，可重复")
+    parser.add_argument("--stage", action="append", help="只模拟指定副本，可重复")
+    parser.add_argument("--all-weapons", action="store_true", help="模拟每一把可购买的武器，而不只是最强的一把")
+    parser.add_argument("--content", default=GAME_CONTENT_PATH, help="游戏内容文件，可以用来试验修改后的数值")
+    args = parser.parse_args()
+
+    content = load_content(args.content)
+    rng = np.random.default_rng(args.seed)
+    realms = args.realm or list(REALMS)
+    stages = args.stage or list(content.stages)
+
+    started = time.perf_counter()
+    print(f"每项模拟 {args.trials} 次，每小时恢复灵力 {SPIRIT_REGEN_PER_HOUR}")
+    print(
+        f"  {'活动':<20}{'胜率':>6}{'次/时':>6}{'经验/时':>8}{'±':>8}"
+        f"{'灵石/时':>8}{'±':>8}{'物品折合/时':>8}"
+    )
+    for realm in realms:
+        print(f"\n【{realm}】")
+        for stats in (simulate_herbs(content, rng, realm, args.trials), simulate_mining(content, rng, realm, args.trials)):
+            if stats is not None:
+                print_row(stats.name, stats)
+
+        available_stages = content.stages_by_level[REALM_LEVELS[realm]]
+        for stage_name in stages:
+            if stage_name not in available_stages:
+                continue
+            for loadout in loadouts_for(content, realm, args.all_weapons):
+                stats = simulate_stage(content, rng, loadout, stage_name, args.trials)
+                print_row(f"{stage_name}·{loadout.weapon or '无武器'}", stats)
+
+    print(f"\n耗时 {time.perf_counter() - started:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()